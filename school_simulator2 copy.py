@@ -1,11 +1,32 @@
 import typing
 import pygame, sys
+import argparse
+import multiprocessing
+import time
+import tracemalloc
 from math import *
 from random import *
+import random
 
 from PIL import Image
-from noise import pnoise2
+import numpy as np
 import json
+import os
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+import hashlib
+import struct
+import gzip
+import tempfile
+import warnings
+import heapq
+from functools import cached_property, lru_cache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFINITIONS_PATH = os.path.join(BASE_DIR, "building_definitions.json")
+# Per-user cache, not the checkout, which may be read only; SCHOOL_SIM_CACHE_DIR overrides it
+CACHE_DIR = os.environ.get("SCHOOL_SIM_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "school_sim")
 
 class Button():
     def __init__(self, label, label_size, color, id, location, dimensions, typing, visible, object=None, font_name=None, text_color=None, absolute=False, outline_width=0, outline_color=(0, 0, 0)):
@@ -44,11 +65,19 @@ class Button():
                                     self.dimensions[0], self.dimensions[1]), self.outline_width)
         
         # Draw text
-        font = get_font(self.label_size, self.font_name)  # Use custom font
-        text = font.render(self.label, True, self.text_color)
+        text = render_text(self.label, self.label_size, self.text_color, self.font_name)
         text_rect = text.get_rect(center=(screen_x + self.dimensions[0] / 2,
                                           screen_y + self.dimensions[1] / 2))
         screen.blit(text, text_rect)
+    def screen_rect(self):
+        """Screen pixels the button covers, including label text that spills past it"""
+        if self.absolute:
+            screen_x, screen_y = self.location[0], self.location[1]
+        else:
+            screen_x, screen_y = world_to_screen(self.location[0], self.location[1])
+        rect = pygame.Rect(screen_x, screen_y, self.dimensions[0], self.dimensions[1])
+        text = render_text(self.label, self.label_size, self.text_color, self.font_name)
+        return rect.union(text.get_rect(center=rect.center)).inflate(2, 2)  # Margin for fractional offsets
     def check_click(self, mouse_pos):
         if self.visible:
             # Convert mouse position based on positioning mode
@@ -71,10 +100,21 @@ class Text():
         self.size = size
         self.font_name = font_name
         self.absolute = absolute  # If True, not affected by camera pan
-    
+    def __setattr__(self, name, value):
+        # Any change is a visual change; blocks compare versions to know their cached copy is stale
+        object.__setattr__(self, name, value)
+        if name != "version":
+            object.__setattr__(self, "version", getattr(self, "version", 0) + 1)
+    def rasterize(self):
+        return render_text(self.text, self.size, self.color, self.font_name)
+    def screen_rect(self):
+        if self.absolute:
+            screen_x, screen_y = self.location[0], self.location[1]
+        else:
+            screen_x, screen_y = world_to_screen(self.location[0], self.location[1])
+        return self.rasterize().get_rect(topleft=(screen_x, screen_y)).inflate(2, 2)
     def render(self, screen):
-        font = get_font(self.size, self.font_name)  # Use custom font if specified
-        text = font.render(self.text, True, self.color)
+        text = self.rasterize()
         # Apply camera offset only if not absolute positioning
         if self.absolute:
             screen_x, screen_y = self.location[0], self.location[1]
@@ -95,34 +135,267 @@ class Block():
         self.outline_width = outline_width  # 0 = no outline
         self.outline_color = outline_color  # Color of outline
         self.block_id = block_id
-    def render(self, screen):
-        # Apply camera offset only if not absolute positioning
-        if self.absolute:
-            screen_x, screen_y = self.location[0], self.location[1]
-        else:
-            screen_x, screen_y = world_to_screen(self.location[0], self.location[1])
-        
-        # Create surface with alpha support for transparency
-        surface = pygame.Surface((self.dimensions[0], self.dimensions[1]), pygame.SRCALPHA)
-        
+        self.surface = None  # Pre-composited block and static children
+        self.offset = (0, 0)  # Where the surface's origin sits relative to location
+        self.surface_key = None
+    # Setting any of these marks the cached surface stale
+    DRAWN = ("structure", "location", "dimensions", "color", "opacity", "outline_width", "outline_color", "absolute")
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in Block.DRAWN:
+            object.__setattr__(self, "version", getattr(self, "version", 0) + 1)
+    def static(self, element):
+        # Text and nested blocks in the same coordinate space are baked in; buttons stay live
+        return isinstance(element, (Text, Block)) and element.absolute == self.absolute
+    def key(self):
+        # Changes anywhere in the static subtree show up here
+        return (self.version, tuple((id(element), element.key() if isinstance(element, Block) else element.version)
+                                    for line in self.structure for element in line if self.static(element)))
+    def compose(self):
+        # Premultiplied RGBA so that baking children in and blitting once matches drawing them one by one
+        parts = []
+        for line in self.structure:
+            for element in line:
+                if not self.static(element):
+                    continue
+                if isinstance(element, Block):
+                    surface, offset = element.cached()
+                    location = (element.location[0] + offset[0], element.location[1] + offset[1])
+                else:
+                    surface = element.rasterize().convert_alpha().premul_alpha()
+                    location = element.location
+                parts.append((surface, location[0] - self.location[0], location[1] - self.location[1]))
+        bounds = pygame.Rect(0, 0, self.dimensions[0], self.dimensions[1])
+        bounds = bounds.unionall([pygame.Rect(x, y, *surface.get_size()) for surface, x, y in parts]) if parts else bounds
+        surface = pygame.Surface(bounds.size, pygame.SRCALPHA)
+        rect = (-bounds.x, -bounds.y, self.dimensions[0], self.dimensions[1])
         # Draw rectangle with specified opacity
-        color_with_alpha = (*self.color, self.opacity)  # Add alpha channel to RGB
-        pygame.draw.rect(surface, color_with_alpha, (0, 0, self.dimensions[0], self.dimensions[1]))
-        
+        premultiplied = tuple(c * self.opacity // 255 for c in self.color)
+        pygame.draw.rect(surface, (*premultiplied, self.opacity), rect)
         # Draw outline if specified
         if self.outline_width > 0:
             outline_with_alpha = (*self.outline_color, 255)  # Outline always fully opaque
-            pygame.draw.rect(surface, outline_with_alpha, (0, 0, self.dimensions[0], self.dimensions[1]), self.outline_width)
-        
-        # Blit transparent surface to screen
-        screen.blit(surface, (screen_x, screen_y))
-        
-        # Render text on top
+            pygame.draw.rect(surface, outline_with_alpha, rect, self.outline_width)
+        for part, x, y in parts:
+            surface.blit(part, (x - bounds.x, y - bounds.y), special_flags=pygame.BLEND_PREMULTIPLIED)
+        return surface, bounds.topleft
+    def cached(self):
+        key = self.key()
+        if self.surface is None or key != self.surface_key:
+            surface, offset = self.compose()
+            self.surface, self.offset, self.surface_key = surface, offset, key
+        return self.surface, self.offset
+    def live(self):
+        # Buttons anywhere in the tree, and anything positioned in the other coordinate space
         for line in self.structure:
             for element in line:
-                element.render(screen)
+                if not self.static(element):
+                    yield element
+                elif isinstance(element, Block):
+                    yield from element.live()
+    def screen_rect(self):
+        """Screen pixels the composited block covers"""
+        if self.absolute:
+            screen_x, screen_y = self.location[0], self.location[1]
+        else:
+            screen_x, screen_y = world_to_screen(self.location[0], self.location[1])
+        surface, offset = self.cached()
+        rect = surface.get_rect(topleft=(screen_x + offset[0], screen_y + offset[1]))
+        for element in self.live():
+            rect.union_ip(element.screen_rect())
+        return rect.inflate(2, 2)  # Margin for fractional offsets
+    def render(self, screen):
+        # Apply camera offset only if not absolute positioning
+        if self.absolute:
+            screen_x, screen_y = self.location[0], self.location[1]
+        else:
+            screen_x, screen_y = world_to_screen(self.location[0], self.location[1])
+        # One blit for the block and its static children
+        surface, offset = self.cached()
+        screen.blit(surface, (screen_x + offset[0], screen_y + offset[1]), special_flags=pygame.BLEND_PREMULTIPLIED)
+        for element in self.live():
+            element.render(screen)
                 
+class TextCache():
+    # Rendered text surfaces, least recently used first, evicted past max_bytes of pixels.
+    # Callers only blit or copy the surfaces they get back; they are shared.
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()  # (text, font name, size, color, antialias) -> Surface
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+    def get(self, text, size, color, font_name=None, antialias=True):
+        key = (text, font_name, size, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = get_font(size, font_name).render(text, antialias, color)
+        self.surfaces[key] = surface
+        self.bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.bytes -= evicted.get_width() * evicted.get_height() * evicted.get_bytesize()
+        return surface
+class SpatialGrid():
+    # Uniform grid over world pixel rects. query returns the items touching a rect in insertion
+    # order, so drawing them keeps the original painter's order.
+    def __init__(self, cell_size=160):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell col, cell row) -> item indices
+        self.items = []
+        self.rects = []
+    def cells_for(self, rect):
+        size = self.cell_size
+        for cell_x in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cell_y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield (cell_x, cell_y)
+    def insert(self, item, rect):
+        rect = pygame.Rect(rect)
+        if rect.width <= 0 or rect.height <= 0:
+            return  # Nothing to draw, e.g. a green space that never grew
+        index = len(self.items)
+        self.items.append(item)
+        self.rects.append(rect)
+        for cell in self.cells_for(rect):
+            self.cells.setdefault(cell, []).append(index)
+    def query(self, rect):
+        rect = pygame.Rect(rect)
+        found = set()
+        for cell in self.cells_for(rect):
+            for index in self.cells.get(cell, ()):
+                if index not in found and self.rects[index].colliderect(rect):
+                    found.add(index)
+        return [self.items[index] for index in sorted(found)]
+class WorldLayer():
+    # The static campus pre-drawn in world space, in square chunks per (mode, floor) that are only
+    # rendered once they come into view and are dropped least recently used first. Frames blit the
+    # chunks under the camera instead of redrawing every building, room and green space.
+    CHUNK = 256  # World pixels per chunk side
+    BLEED = 8  # Extra pixels drawn around a chunk and never shown, since outlines clipped at a surface edge draw wrong
+    def __init__(self, max_chunks=256):
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()  # (mode, floor, chunk x, chunk y) -> Surface
+        self.structures = None
+        self.grid = None
+        self.key = None
+    def invalidate(self):
+        self.chunks.clear()
+        self.structures = None
+        self.grid = None
+        self.key = None
+    def sync(self, structures):
+        # Index the campus the first time it is drawn
+        if structures is not self.structures:
+            self.invalidate()
+            self.structures = structures
+            self.grid = SpatialGrid()
+            self.grid.insert(("map", None), (0, 0, 75 * 10, 75 * 10))
+            for building in structures[0]:
+                self.grid.insert(("building", building), (building.location[0] * 10, building.location[1] * 10, building.dimensions[0] * 10, building.dimensions[1] * 10))
+            for green_space in structures[1]:
+                self.grid.insert(("green", green_space), (green_space.location[0] * 10, green_space.location[1] * 10, green_space.dimensions[0] * 10, green_space.dimensions[1] * 10))
+            for button in label_buttons():
+                self.grid.insert(("label", button), (button.location, button.dimensions))
+        return self.grid
+    def set_mode(self, structures, floor, mode):
+        if (mode, floor) != self.key:
+            # Map buttons are clickable only in the mode that shows them
+            for building in structures[0]:
+                building.button.visible = mode == "normal"
+            for button in label_buttons():
+                button.visible = True
+            self.key = (mode, floor)
+    def chunk(self, chunk_x, chunk_y, floor, mode):
+        key = (mode, floor, chunk_x, chunk_y)
+        surface = self.chunks.get(key)
+        if surface is not None:
+            self.chunks.move_to_end(key)
+            return surface
+        side = self.CHUNK + 2 * self.BLEED
+        surface = pygame.Surface((side, side))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        origin = (chunk_x * self.CHUNK - self.BLEED, chunk_y * self.CHUNK - self.BLEED)
+        items = self.grid.query((*origin, side, side))
+        # Draw with the camera parked on the chunk, and every button in its resting color so a
+        # hover at build time is not baked in
+        buttons = [item.button if kind == "building" else item for kind, item in items if kind in ("building", "label")]
+        colors = [button.color for button in buttons]
+        saved = camera_offset[:]
+        camera_offset[:] = origin
+        try:
+            for button in buttons:
+                button.color = button.normal_color
+            draw_world(surface, items, floor, mode)
+        finally:
+            camera_offset[:] = saved
+            for button, color in zip(buttons, colors):
+                button.color = color
+        self.chunks[key] = surface
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return surface
+    def draw(self, screen, structures, floor, mode):
+        self.sync(structures)
+        self.set_mode(structures, floor, mode)
+        view = camera_rect(screen)
+        for chunk_x in range(view.left // self.CHUNK, (view.right - 1) // self.CHUNK + 1):
+            for chunk_y in range(view.top // self.CHUNK, (view.bottom - 1) // self.CHUNK + 1):
+                # Floor, not blit's truncation, so chunks land where per-object drawing put their pixels
+                screen_x, screen_y = world_to_screen(chunk_x * self.CHUNK, chunk_y * self.CHUNK)
+                screen.blit(self.chunk(chunk_x, chunk_y, floor, mode), (int(screen_x // 1), int(screen_y // 1)),
+                            (self.BLEED, self.BLEED, self.CHUNK, self.CHUNK))
+class RenderScheduler():
+    # Screen regions changed since the last present. A frame redraws under a clip covering them
+    # and pushes only those rects; with nothing dirty or animating the loop sleeps on events.
+    IDLE_TIMEOUT = 500  # ms, so an idle loop still wakes now and then
+    def __init__(self):
+        self.dirty = []
+        self.full = True  # The first frame draws everything
+        self.frames = 0
+        self.idle_waits = 0
+    def mark(self, rect):
+        if not self.full:
+            self.dirty.append(pygame.Rect(rect))
+    def mark_all(self):
+        self.full = True
+        self.dirty = []
+    def pending(self):
+        return self.full or bool(self.dirty)
+    def events(self, animating):
+        """Events since the last frame, blocking for the first one when there is nothing to draw"""
+        if animating or self.pending():
+            return pygame.event.get()
+        self.idle_waits += 1
+        event = pygame.event.wait(self.IDLE_TIMEOUT)
+        return ([] if event.type == pygame.NOEVENT else [event]) + pygame.event.get()
+    def begin(self, screen):
+        """Clip the screen to the dirty regions; False when there is nothing to draw"""
+        if self.full:
+            screen.set_clip(None)
+            return True
+        bounds = screen.get_rect()
+        self.dirty = [rect.clip(bounds) for rect in self.dirty if rect.colliderect(bounds)]
+        if not self.dirty:
+            return False
+        screen.set_clip(self.dirty[0].unionall(self.dirty[1:]))
+        return True
+    def present(self, screen):
+        screen.set_clip(None)
+        if self.full:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.dirty)
+        self.frames += 1
+        self.full = False
+        self.dirty = []
 class Building():
+    # Slotted: large campuses hold tens of thousands of buildings and rooms
+    __slots__ = ("name", "location", "dimensions", "connections", "subject", "floors", "rooms", "button", "corridors", "corridor_connections", "interior_seed")
     def __init__(self, name, location=(0,0), dimensions=(0,0), connections=None, subject=None, floors=1, rooms=None, corridors=None, corridor_connections=None, button=None):
         self.name = name
         self.location = location
@@ -138,83 +411,33 @@ class Building():
         else:
             self.corridors = corridors
         self.corridor_connections = corridor_connections if corridor_connections is not None else []
-    def occupied(self, buildings):
-        occupied = set()
-        # Skip if building hasn't been placed yet (dimensions are 0)
-        if self.dimensions[0] == 0 or self.dimensions[1] == 0:
-            return occupied
-        # self.location[0] is col (x), self.location[1] is row (y)
-        grid_col = self.location[0]
-        grid_row = self.location[1]
-        grid_width = self.dimensions[0]
-        grid_height = self.dimensions[1]
-        for c in range(grid_col, grid_col + grid_width):
-            for r in range(grid_row, grid_row + grid_height):
-            
-                occupied.add((c, r))  # (col, row) format
-        return occupied
-    def reserved(self, buildings):
-        reserved = set()
-        # Skip if building hasn't been placed yet (dimensions are 0)
-        if self.dimensions[0] == 0 or self.dimensions[1] == 0:
-            return reserved
-        # self.location[0] is col (x), self.location[1] is row (y)
-        grid_col = self.location[0]
-        grid_row = self.location[1]
-        grid_width = self.dimensions[0]
-        grid_height = self.dimensions[1]
-        bound_r = grid_row - 1
-        bound_c = grid_col - 1
-        bound_r_end = grid_row + grid_height + 1
-        bound_c_end = grid_col + grid_width + 1
-        for c in range(bound_c, bound_c_end):
-            for r in range(bound_r, bound_r_end):
-                reserved.add((c, r))  # (col, row) format
-        return reserved
-    def generate_building(self, board_map, buildings, overpopulated, retries=10):
+        self.interior_seed = None  # "<campus seed>:<building index>", set by make_rooms
+    def generate_building(self, board_map, buildings, overpopulated, retries=10, occupancy=None, spawn_index=None, heat_bands=None, rng=random):
         if retries <= 0:
             return self
-        if overpopulated == [True, True, True, True, True]:
+        if all(overpopulated):
             return self
-        zone = randint(0, 4)
+        zones = len(overpopulated)
+        heat_map = as_heat_map(board_map)
+        if occupancy is None:
+            occupancy = OccupancyGrid.from_buildings(heat_map.shape, buildings)
+        if spawn_index is None:
+            spawn_index = SpawnIndex(heat_map, occupancy, zones)
+        if heat_bands is None:
+            heat_bands = HeatBands(heat_map)
+        zone = rng.randint(0, zones - 1)
         while overpopulated[zone]:
-            zone = randint(0, 4)
+            zone = rng.randint(0, zones - 1)
         focus = zone
-        # Establish intervals
-        intervals = [0.3, 0.1, 0.075, 0.075, 0.425]
-        fourth_bound = intervals[0]
-        third_bound = fourth_bound + intervals[1]
-        second_bound = third_bound + intervals[2]
-        first_bound  = second_bound + intervals[3]
-        spawn_bound  = first_bound + intervals[4]
-
-        # Establish occupied and reserved sets
-        occupied = set()
-        reserved = set()
-        for building in buildings:
-            occupied.update(building.occupied(buildings))
-            reserved.update(building.reserved(buildings))
         # Find spawn point
-        cols = len(board_map)
-        rows = len(board_map[0])
+        cols, rows = heat_map.shape
         spawn_col = None
         spawn_row = None
-        # Using focus, find suitable spawn zone
-        all_available = []
-        start_row = focus * rows // 5
-        end_row = min(focus + 1, 4) * rows // 5
-        # Check each column-row combination in zone
-        for col in range(cols):
-            for row in range(start_row, end_row + 1):
-                # Check if the tile is within the spawn bounds
-                if first_bound < board_map[col][row] < spawn_bound:
-                    # Check if the tile is not occupied or reserved (using col, row format)
-                    if (col, row) not in occupied and (col, row) not in reserved:
-                        all_available.append((col, row))  # (col, row) format
-        if not all_available:
+        # Using focus, draw from the zone's remaining spawn candidates
+        if not spawn_index.available(zone):
             overpopulated[zone] = True
-            return self.generate_building(board_map, buildings, overpopulated, retries)
-        spawn_col, spawn_row = choice(all_available)  # (col, row) format
+            return self.generate_building(board_map, buildings, overpopulated, retries, occupancy, spawn_index, heat_bands, rng)
+        spawn_col, spawn_row = spawn_index.sample(zone, rng)  # (col, row) format
         # Set spawn point and begin growth
         self.location = (spawn_col, spawn_row)  # (col, row) format
         reach_x_negative = reach_x_positive = reach_y_negative = reach_y_positive = 0
@@ -230,26 +453,23 @@ class Building():
             r0 = self.location[1] - reach_y_negative
             r1 = self.location[1] + reach_y_positive
             
+            # Strips are inclusive (col0, row0, col1, row1) rectangles one tile thick
             if direction == 1:  # +x (right, expand columns)
-                new_col = c1 + 1
-                return [(new_col, r) for r in range(r0, r1 + 1)]  # (col, row) format
+                return (c1 + 1, r0, c1 + 1, r1)
             elif direction == 2:  # -x (left, expand columns)
-                new_col = c0 - 1
-                return [(new_col, r) for r in range(r0, r1 + 1)]  # (col, row) format
+                return (c0 - 1, r0, c0 - 1, r1)
             elif direction == 3:  # +y (down, expand rows)
-                new_row = r1 + 1
-                return [(c, new_row) for c in range(c0, c1 + 1)]  # (col, row) format
+                return (c0, r1 + 1, c1, r1 + 1)
             elif direction == 4:  # -y (up, expand rows)
-                new_row = r0 - 1
-                return [(c, new_row) for c in range(c0, c1 + 1)]  # (col, row) format
-            return []
+                return (c0, r0 - 1, c1, r0 - 1)
+            return None
         def strip_clear(strip):
-            for col, row in strip:  # (col, row) format
-                if not in_bounds(col, row) or (col, row) in occupied:
-                    return False
-            return True
+            col0, row0, col1, row1 = strip
+            if not in_bounds(col0, row0) or not in_bounds(col1, row1):
+                return False
+            return occupancy.rect_free(col0, row0, col1, row1)
         def in_focus(col, row):
-            return row >= focus * rows // 5 and row < (focus + 1) * rows // 5
+            return row >= focus * rows // zones and row < (focus + 1) * rows // zones
         def non_oblong(reach_x_negative, reach_x_positive, reach_y_negative, reach_y_positive):
             if max(reach_x_negative + reach_x_positive + 1, reach_y_negative + reach_y_positive + 1) > 3*min(reach_x_negative + reach_x_positive + 1, reach_y_negative + reach_y_positive + 1):
                 return False
@@ -259,7 +479,7 @@ class Building():
         viable_directions = [1, 2, 3, 4]
         while viable_directions and (reach_x_negative + reach_x_positive + 1) * (reach_y_negative + reach_y_positive + 1) < 100:
             # Choose and validate direction
-            direction = choice(viable_directions)
+            direction = rng.choice(viable_directions)
             strip = new_strip(direction, reach_x_negative, reach_x_positive, reach_y_negative, reach_y_positive)
             if not strip:
                 viable_directions.remove(direction)
@@ -277,200 +497,50 @@ class Building():
             elif direction == 4:
                 reach_y_negative += 1
             # add chances up:
+            # A strip with no weighted heat tiles keeps chance at 0, so none of its rolls can stop growth
+            if not heat_bands.weighted_count(*strip):
+                continue
             chance = 0
-            for col, row in strip:  # (col, row) format
-                v = board_map[col][row]  # board_map is indexed [col][row]
-                if v <= fourth_bound:
-                    chance += 3
-                elif v <= third_bound:
-                    chance += 2
-                elif v <= second_bound:
-                    chance += 1
-                elif v <= first_bound:
-                    chance += 0
+            col0, row0, col1, row1 = strip
+            for col in range(col0, col1 + 1):
+                for row in range(row0, row1 + 1):
+                    chance += heat_bands.weight(col, row)
+                    if not in_focus(col, row):
+                        chance *= 2
+                    if chance > 100:
+                        chance = 100
+                    if rng.randint(1, 100) < chance:
+                        viable_directions.remove(direction)
+                        break
                 else:
-                    chance += 0
-                if not in_focus(col, row):
-                    chance *= 2
-                if chance > 100:
-                    chance = 100
-                if randint(1, 100) < chance:
-                    viable_directions.remove(direction)
-                    break
+                    continue
+                break
         if not non_oblong(reach_x_negative, reach_x_positive, reach_y_negative, reach_y_positive):
             self.location = (0, 0)
             self.dimensions = (0, 0)
-            return self.generate_building(board_map, buildings, overpopulated, retries-1)
+            return self.generate_building(board_map, buildings, overpopulated, retries-1, occupancy, spawn_index, heat_bands, rng)
         # -------- finalize building + occupy tiles --------
         # self.location[0] is col (x), self.location[1] is row (y)
         # reach_x is for columns, reach_y is for rows
         self.location = ((self.location[0] - reach_x_negative), (self.location[1] - reach_y_negative))  # (col, row) format
         self.dimensions = ((reach_x_positive + reach_x_negative + 1), (reach_y_positive + reach_y_negative + 1))
+        occupancy.add_building(self)
+        spawn_index.discard_building(self)
         return self
-    def make_connections(self, buildings):
-        def border_exists(building1, building2):
-            # Get borders of both buildings
-            building1_west = building1.location[0]
-            building1_east = building1.location[0] + building1.dimensions[0]
-            building1_north = building1.location[1]
-            building1_south = building1.location[1] + building1.dimensions[1]
-            
-            building2_west = building2.location[0]
-            building2_east = building2.location[0] + building2.dimensions[0]
-            building2_north = building2.location[1]
-            building2_south = building2.location[1] + building2.dimensions[1]
-            
-            if building1_north == building2_south:
-                if building1_west <= building2_east and building1_east >= building2_west or building2_west <= building1_east and building2_east >= building1_west:
-                    return True
-            elif building1_south == building2_north:
-                if building1_west <= building2_east and building1_east >= building2_west or building2_west <= building1_east and building2_east >= building1_west:
-                    return True
-            elif building1_west == building2_east:
-                if building1_north <= building2_south and building1_south >= building2_north or building2_north <= building1_south and building2_south >= building1_north:
-                    return True
-            elif building1_east == building2_west:
-                if building1_north <= building2_south and building1_south >= building2_north or building2_north <= building1_south and building2_south >= building1_north:
-                    return True
-            return False
-        # Make connections between THIS building and other buildings
-        for i in range(len(buildings)):
-            if border_exists(self, buildings[i]) and self != buildings[i]:
-                self.connections.append(buildings[i])
-    def assign_building(self, buildings_sorted_subject, subject, buildings):
-        index = randint(0, len(buildings_sorted_subject[subject]) - 1)
-        names = [building.name for building in buildings]
-        while buildings_sorted_subject[subject][index]['name'] in names:
-            index = randint(0, len(buildings_sorted_subject[subject]) - 1)
-        self.name = buildings_sorted_subject[subject][index]['name']
+    def assign_building(self, registry, subject, rng=random, name=None):
+        self.name = name if name is not None else registry.take(subject, rng)
         self.subject = subject
-        self.floors = randint(1, 4)
+        self.floors = rng.randint(1, 4)
         # Reinitialize to match new floor count
         self.rooms = [[] for _ in range(self.floors)]
         self.corridors = [{"x": [], "y": []} for _ in range(self.floors)]
         return self
-    def generate_corridors(self, floor=0):
-        while len(self.corridors) <= floor:
-            self.corridors.append({"x": [], "y": []})
-
-        # Copy from floor 0 if this is an upper floor
-        if floor > 0 and len(self.corridors) > 0:
-            self.corridors[floor]["x"] = self.corridors[0]["x"].copy()
-            self.corridors[floor]["y"] = self.corridors[0]["y"].copy()
-            return self  # Skip rest of generation
+    def build_rooms(self, floor, rng=random):
+        # Room list for one floor, laid out around that floor's corridors
+        rooms = []
         if self.subject in ["Cafeteria", "Library", "PE", "Theater"]:
-            return self
-        self.corridors[floor]["x"] = []
-        self.corridors[floor]["y"] = []
-
-
-        # Define border direction
-        def border_direction(building1, building2):
-            if building1.location[0] + building1.dimensions[0] == building2.location[0] or building1.location[0] == building2.location[0] + building2.dimensions[0]:
-                # Left or right border
-                return "leftright"
-            elif building1.location[1] + building1.dimensions[1] == building2.location[1] or building1.location[1] == building2.location[1] + building2.dimensions[1]:
-                # Top or bottom border
-                return "topbottom"
-            else:
-                # No border
-                return None
-        
-        def surroundings_clear(corridor, direction, floor):
-            if direction == "topbottom":  # X corridors
-                corridor_list = self.corridors[floor]["x"]
-            elif direction == "leftright":  # Y corridors
-                corridor_list = self.corridors[floor]["y"]
-            
-            if corridor in corridor_list:
-                return False
-            if corridor + 1 in corridor_list:
-                return False
-            if corridor - 1 in corridor_list:
-                return False
-            return True
-        
-        def in_bounds(corridor, direction):
-            if direction == "vertical":
-                return corridor >= 0 and corridor <= self.dimensions[0] - 1
-            elif direction == "horizontal":
-                return corridor >= 0 and corridor <= self.dimensions[1] - 1
-            else:
-                return True
-        
-        for building in self.connections:
-            if len(building.corridors) - 1 < floor:
-                continue
-            direction = border_direction(self, building)
-            if direction == "topbottom":
-                for corridor in building.corridors[floor]["x"]:
-                    offset = self.location[0] - building.location[0]
-                    proposition = corridor - offset
-                    if proposition > 0 and proposition < self.dimensions[0] - 1 and surroundings_clear(proposition, "topbottom", floor):
-                        self.corridors[floor]["x"].append(proposition)
-                        if building not in self.corridor_connections:
-                            self.corridor_connections.append(building)
-            elif direction == "leftright":
-                for corridor in building.corridors[floor]["y"]:
-                    offset = self.location[1] - building.location[1]
-                    proposition = corridor - offset
-                    if proposition > 0 and proposition < self.dimensions[1] - 1 and surroundings_clear(proposition, "leftright", floor):
-                        self.corridors[floor]["y"].append(proposition)
-                        if building not in self.corridor_connections:
-                            self.corridor_connections.append(building)
-        self.corridors[floor]["x"].sort()
-        self.corridors[floor]["y"].sort()
-        if (not self.corridors[floor]["x"]) or (not self.corridors[floor]["y"]):
-            if not self.corridors[floor]["x"]:
-                possible_corridors = []
-                for i in range(1, self.dimensions[0] - 1):
-                    if surroundings_clear(i, "leftright", floor):
-                        possible_corridors.append(i)
-                if possible_corridors:
-                    proposition = choice(possible_corridors)
-                    self.corridors[floor]["x"].append(proposition)
-                else:
-                    return self
-            if not self.corridors[floor]["y"]:
-                possible_corridors = []
-                for i in range(1, self.dimensions[1] - 1):
-                    if surroundings_clear(i, "topbottom", floor):
-                        possible_corridors.append(i)
-                if possible_corridors:
-                    proposition = choice(possible_corridors)
-                    self.corridors[floor]["y"].append(proposition)
-                else:
-                    return self
-    def generate_rooms(self, floor):
-        def classify_by_area(area, rooms):
-            types = []
-            for room in rooms:
-                types.append(room.identity)
-            if "Bathroom" not in types and area >= 3:
-                return "Bathroom"
-            if "Office" not in types and area >= 4:
-                return "Office"
-            if "Classroom" not in types and area >= 8:
-                return "Classroom"
-            # Start classification for room types by area.
-            # Guarantee a few necessary room types by size thresholds.
-            bathrooms = 0
-            for room in rooms:
-                if room.identity == "Bathroom":
-                    bathrooms += 1
-            if area >= 8:
-                return "Classroom"
-            elif area >= 4:
-                return "Office"
-            elif area >= 3 and bathrooms < 1:
-                return "Bathroom"
-            else:
-                return "Storage"
-        while len(self.rooms) <= floor:
-            self.rooms.append([])
-        if self.subject in ["Cafeteria", "Library", "PE", "Theater"]:
-            self.rooms[floor].append(Room(name=f"{self.name[0:3].upper()}-{self.subject.upper()}-{floor}", location=(0, 0), dimensions=(self.dimensions[0], self.dimensions[1]), parent_building=self, subject=self.subject, identity=self.subject))
-            return self
+            rooms.append(Room(name=f"{self.name[0:3].upper()}-{self.subject.upper()}-{floor}", location=(0, 0), dimensions=(self.dimensions[0], self.dimensions[1]), parent_building=self, subject=self.subject, identity=self.subject))
+            return rooms
         corridors = self.corridors[floor]
         zones = []
         # Create boundaries that split zones AROUND corridors, not through them
@@ -523,13 +593,13 @@ class Building():
                         if divisions == 1:
                             new_height = zone["dimensions"][1] - total_difference
                         else:
-                            new_height = min(4+randint(-1, 1), zone["dimensions"][1] - total_difference)
+                            new_height = min(4+rng.randint(-1, 1), zone["dimensions"][1] - total_difference)
                         heights.append(new_height)
                     total_difference += heights[-1]
                     divisions -= 1
                 total_height = 0
                 for height in heights:
-                    self.rooms[floor].append(Room(name=f"{self.name[0:3].upper()}-{floor}{len(self.rooms[floor])}", location=(zone["location"][0], zone["location"][1] + total_height), dimensions=(zone["dimensions"][0], height), parent_building=self, subject=self.subject))
+                    rooms.append(Room(name=f"{self.name[0:3].upper()}-{floor}{len(rooms)}", location=(zone["location"][0], zone["location"][1] + total_height), dimensions=(zone["dimensions"][0], height), parent_building=self, subject=self.subject))
                     total_height += height
             elif direction == "vertical":  
                 divisions = zone["dimensions"][0] // 3
@@ -549,23 +619,24 @@ class Building():
                         if divisions == 1:
                             new_width = zone["dimensions"][0] - total_difference
                         else:
-                            new_width = min(4+randint(-1, 1), zone["dimensions"][0] - total_difference)
+                            new_width = min(4+rng.randint(-1, 1), zone["dimensions"][0] - total_difference)
                         widths.append(new_width)
                     total_difference += widths[-1]
                     divisions -= 1
                 total_width = 0
                 for width in widths:
-                    self.rooms[floor].append(Room(name=f"{self.name[0:3].upper()}-{floor}{len(self.rooms[floor])}", location=(zone["location"][0] + total_width, zone["location"][1]), dimensions=(width, zone["dimensions"][1]), parent_building=self, subject=self.subject))
+                    rooms.append(Room(name=f"{self.name[0:3].upper()}-{floor}{len(rooms)}", location=(zone["location"][0] + total_width, zone["location"][1]), dimensions=(width, zone["dimensions"][1]), parent_building=self, subject=self.subject))
                     total_width += width
-                # Iterate through rooms in area order without modifying list
-        sorted_rooms = sorted(self.rooms[floor], key=lambda r: r.dimensions[0] * r.dimensions[1], reverse=False)
-        largest_room = sorted_rooms[-1]
-
-        for room in sorted_rooms:
-            area = room.dimensions[0] * room.dimensions[1]
-            room.identity = classify_by_area(area, self.rooms[floor])
-            if room == largest_room and room.identity != "Classroom" and room.identity not in ["Cafeteria", "Library", "PE", "Theater"]:
-                room.identity = "Classroom"
+        _room_classifier.classify(rooms, self.subject)
+        return rooms
+    def generate_rooms(self, floor, rng=random):
+        while len(self.rooms) <= floor:
+            self.rooms.append([])
+        self.rooms[floor] = self.build_rooms(floor, rng)
+        return self
+    def floor_rng(self, floor):
+        # Each floor gets its own generator, so a floor lays out the same whenever it is built
+        return random.Random(f"{self.interior_seed}:{floor}")
     def create_button(self, tile_size):
         self.button = Button(
             label="",
@@ -638,48 +709,21 @@ class Building():
             pygame.draw.rect(screen, (150, 75, 25), (building_x, building_y, building_width, building_height))
             overlay_interior(screen, self, floor)
 class GreenSpace():
+    __slots__ = ("name", "location", "dimensions")
     def __init__(self, name, location, dimensions):
         self.name = name
         self.location = location
         self.dimensions = dimensions
-    def occupied(self):
-        occupied = set()
-        grid_col = self.location[0]
-        grid_row = self.location[1]
-        grid_width = self.dimensions[0]
-        grid_height = self.dimensions[1]
-        for c in range(grid_col, grid_col + grid_width):
-            for r in range(grid_row, grid_row + grid_height):   
-                occupied.add((c, r))  # (col, row) format
-        return occupied
-    def generate_green_space(self, board_map, green_spaces, buildings, retries=3):
+    def generate_green_space(self, board_map, green_spaces, buildings, retries=3, free_space=None, rng=random):
         if retries <= 0:
             return self  # Give up after max retries
-        cols = len(board_map)
-        rows = len(board_map[0])
-        total_occupied = set()
-        for building in buildings:
-            if building.dimensions[0] == 0 or building.dimensions[1] == 0:
-                continue  # Skip unplaced buildings
-            # building.location[0] is col, building.location[1] is row
-            # building.dimensions[0] is width (cols), building.dimensions[1] is height (rows)
-            for i in range(building.dimensions[0] + 6):  # width + 8 tile buffer
-                for j in range(building.dimensions[1] + 6):  # height + 8 tile buffer
-                    col = building.location[0] - 3 + i
-                    row = building.location[1] - 3 + j
-                    if 0 <= col < cols and 0 <= row < rows:  # Bounds check
-                        total_occupied.add((col, row))  # (col, row) format
-        for green_space in green_spaces:
-            if green_space.dimensions[0] > 0 and green_space.dimensions[1] > 0:
-                total_occupied.update(green_space.occupied())
-        all_available = []
-        for c in range(cols):
-            for r in range(rows):
-                if (c, r) not in total_occupied:  # (col, row) format
-                    all_available.append((c, r))  # (col, row) format
-        if not all_available:
+        cols, rows = as_heat_map(board_map).shape
+        if free_space is None:
+            free_space = FreeSpace((cols, rows), buildings, green_spaces)
+        spawn = free_space.sample(rng)
+        if spawn is None:
             return self  # No space available, return with (0,0) dimensions
-        self.location = choice(all_available)
+        self.location = spawn
         reach_x_negative = reach_x_positive = reach_y_negative = reach_y_positive = 0
         # Define validation functions
         def in_bounds(col, row):
@@ -692,24 +736,21 @@ class GreenSpace():
             r0 = self.location[1] - reach_y_negative
             r1 = self.location[1] + reach_y_positive
             
+            # Strips are inclusive (col0, row0, col1, row1) rectangles one tile thick
             if direction == 1:  # +x (right, expand columns)
-                new_col = c1 + 1
-                return [(new_col, r) for r in range(r0, r1 + 1)]  # (col, row) format
+                return (c1 + 1, r0, c1 + 1, r1)
             elif direction == 2:  # -x (left, expand columns)
-                new_col = c0 - 1
-                return [(new_col, r) for r in range(r0, r1 + 1)]  # (col, row) format
+                return (c0 - 1, r0, c0 - 1, r1)
             elif direction == 3:  # +y (down, expand rows)
-                new_row = r1 + 1
-                return [(c, new_row) for c in range(c0, c1 + 1)]  # (col, row) format
+                return (c0, r1 + 1, c1, r1 + 1)
             elif direction == 4:  # -y (up, expand rows)
-                new_row = r0 - 1
-                return [(c, new_row) for c in range(c0, c1 + 1)]  # (col, row) format
-            return []
+                return (c0, r0 - 1, c1, r0 - 1)
+            return None
         def strip_clear(strip):
-            for col, row in strip:  # (col, row) format
-                if not in_bounds(col, row) or (col, row) in total_occupied:
-                    return False
-            return True
+            col0, row0, col1, row1 = strip
+            if not in_bounds(col0, row0) or not in_bounds(col1, row1):
+                return False
+            return free_space.rect_free(col0, row0, col1, row1)
         # Begin growing
         viable_directions = [1, 2, 3, 4]
         max_growth_steps = 100  # Prevent infinite loop
@@ -717,7 +758,7 @@ class GreenSpace():
         while viable_directions and growth_steps < max_growth_steps:
             growth_steps += 1
             # Choose and validate direction
-            direction = choice(viable_directions)
+            direction = rng.choice(viable_directions)
             strip = new_strip(direction, reach_x_negative, reach_x_positive, reach_y_negative, reach_y_positive)
             if not strip:
                 viable_directions.remove(direction)
@@ -737,6 +778,7 @@ class GreenSpace():
         # self.location[0] is col, self.location[1] is row
         self.location = ((self.location[0] - reach_x_negative), (self.location[1] - reach_y_negative))  # (col, row) format
         self.dimensions = ((reach_x_positive + reach_x_negative + 1), (reach_y_positive + reach_y_negative + 1))
+        free_space.add_green_space(self)
         return self
     def render(self, screen):
         world_x = self.location[0] * 10
@@ -745,13 +787,982 @@ class GreenSpace():
         pygame.draw.rect(screen, (30, 120, 30), (screen_x, screen_y,
                                               self.dimensions[0]*10, self.dimensions[1]*10))
 class Room():
+    __slots__ = ("name", "location", "dimensions", "parent_building", "identity")
     def __init__(self, name, location, dimensions, parent_building, subject, identity=None):
         self.name = name
         self.location = location
         self.dimensions = dimensions
         self.parent_building = parent_building
         self.identity = identity
-    
+class RoomClassifier():
+    # Room identities from a rules table, one pass over the floor smallest room first.
+    # "required" hands out (identity, min area, per floor count) until each count is met,
+    # then "by_area" takes the first (identity, min area) that fits, else "fallback".
+    # "largest" overrides the biggest room. Subjects without an entry use "default".
+    RULES = {
+        "default": {
+            "required": (("Bathroom", 3, 1), ("Office", 4, 1), ("Classroom", 8, 1)),
+            "by_area": (("Classroom", 8), ("Office", 4)),
+            "fallback": "Storage",
+            "largest": "Classroom",
+        },
+    }
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else self.RULES
+    def identity(self, area, counts, rules):
+        for identity, min_area, min_count in rules["required"]:
+            if area >= min_area and counts.get(identity, 0) < min_count:
+                return identity
+        for identity, min_area in rules["by_area"]:
+            if area >= min_area:
+                return identity
+        return rules["fallback"]
+    def classify(self, rooms, subject=None):
+        rules = self.rules.get(subject, self.rules["default"])
+        counts = {}  # Running total per identity on this floor
+        ordered = sorted(rooms, key=lambda r: r.dimensions[0] * r.dimensions[1])
+        for room in ordered:
+            room.identity = self.identity(room.dimensions[0] * room.dimensions[1], counts, rules)
+            counts[room.identity] = counts.get(room.identity, 0) + 1
+        if ordered and rules.get("largest"):
+            ordered[-1].identity = rules["largest"]
+        return rooms
+_room_classifier = RoomClassifier()
+class InteriorCache():
+    # Bounded LRU of generated floors, keyed by (building, floor)
+    def __init__(self, max_floors=256):
+        self.max_floors = max_floors
+        self.floors = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def get(self, building, floor):
+        key = (id(building), floor)
+        rooms = self.floors.get(key)
+        if rooms is not None:
+            self.hits += 1
+            self.floors.move_to_end(key)
+            return rooms
+        self.misses += 1
+        rooms = building.build_rooms(floor, building.floor_rng(floor))
+        self.floors[key] = rooms
+        if len(self.floors) > self.max_floors:
+            self.floors.popitem(last=False)
+        return rooms
+class LazyRooms():
+    # Stands in for Building.rooms; floors are generated through the cache when first read
+    def __init__(self, building, interiors):
+        self.building = building
+        self.interiors = interiors
+    def __len__(self):
+        return self.building.floors
+    def __getitem__(self, floor):
+        if isinstance(floor, slice):
+            return [self[i] for i in range(*floor.indices(len(self)))]
+        if floor < 0:
+            floor += len(self)
+        if not 0 <= floor < len(self):
+            raise IndexError("floor out of range")
+        return self.interiors.get(self.building, floor)
+    def __iter__(self):
+        for floor in range(len(self)):
+            yield self[floor]
+class IntegralGrid():
+    # Summed-area table over a fixed 0/1 mask for constant time rectangle counts. Only for masks
+    # that never change: grids updated during placement answer their one tile strips by slicing.
+    def __init__(self, grid_size, mask=None):
+        self.mask = np.zeros(grid_size, dtype=np.uint8) if mask is None else np.asarray(mask, dtype=np.uint8)
+        cols, rows = self.mask.shape
+        self.table = np.zeros((cols + 1, rows + 1), dtype=np.int32)
+        np.cumsum(self.mask, axis=0, dtype=np.int32, out=self.table[1:, 1:])
+        np.cumsum(self.table[1:, 1:], axis=1, out=self.table[1:, 1:])
+    def count(self, col0, row0, col1, row1):
+        # Number of set tiles in the inclusive rectangle (col0, row0)-(col1, row1)
+        table = self.table
+        return int(table[col1 + 1, row1 + 1] - table[col0, row1 + 1] - table[col1 + 1, row0] + table[col0, row0])
+class FreeSpace():
+    # Tiles open to green spaces: building footprints dilated by a buffer, plus every placed green space
+    def __init__(self, grid_size, buildings, green_spaces=(), buffer=3):
+        footprints = np.zeros(grid_size, dtype=np.uint8)
+        for building in buildings:
+            if building.dimensions[0] == 0 or building.dimensions[1] == 0:
+                continue  # Skip unplaced buildings
+            footprints[building.location[0]:building.location[0] + building.dimensions[0],
+                       building.location[1]:building.location[1] + building.dimensions[1]] = 1
+        self.blocked = dilate(footprints, buffer).astype(np.uint8)
+        self.free_per_col = (self.blocked == 0).sum(axis=1)
+        for green_space in green_spaces:
+            self.add_green_space(green_space)
+    def add_green_space(self, green_space):
+        if green_space.dimensions[0] == 0 or green_space.dimensions[1] == 0:
+            return
+        col, row = green_space.location
+        width, height = green_space.dimensions
+        # Only tiles that were still free change the per-column counts
+        newly_blocked = (self.blocked[col:col + width, row:row + height] == 0).sum(axis=1)
+        self.free_per_col[col:col + width] -= newly_blocked
+        self.blocked[col:col + width, row:row + height] = 1
+    def rect_free(self, col0, row0, col1, row1):
+        # Growth tests one tile strips, so a slice costs about as much as a table lookup
+        return not self.blocked[col0:col1 + 1, row0:row1 + 1].any()
+    def sample(self, rng=random):
+        # Uniform free tile without building the free list: pick a column by its free count, then a row in it
+        cumulative = np.cumsum(self.free_per_col)
+        total = int(cumulative[-1]) if len(cumulative) else 0
+        if total == 0:
+            return None
+        k = rng.randrange(total)
+        col = int(np.searchsorted(cumulative, k, side="right"))
+        if col > 0:
+            k -= int(cumulative[col - 1])
+        row = int(np.flatnonzero(self.blocked[col] == 0)[k])
+        return (col, row)  # (col, row) format
+class HeatBands():
+    # Heat band per tile with one summed-area table per band, built once per board
+    WEIGHTS = (3, 2, 1, 0, 0)  # Growth stop weight of each band, coolest first
+    def __init__(self, heat_map):
+        heat_map = as_heat_map(heat_map)
+        # Band k holds tiles at or below the k-th bound; the last band is everything above the first bound
+        self.bands = np.searchsorted(np.array(heat_bounds()[:4]), heat_map, side="left").astype(np.uint8)
+        self.tables = [IntegralGrid(heat_map.shape, self.bands == band) for band in range(len(self.WEIGHTS))]
+        self.weighted = IntegralGrid(heat_map.shape, np.take(self.WEIGHTS, self.bands) > 0)
+    def count(self, band, col0, row0, col1, row1):
+        return self.tables[band].count(col0, row0, col1, row1)
+    def weighted_count(self, col0, row0, col1, row1):
+        return self.weighted.count(col0, row0, col1, row1)
+    def weight(self, col, row):
+        return self.WEIGHTS[self.bands[col, row]]
+class OccupancyGrid():
+    # Bit flags per tile, indexed [col, row] like the heat map
+    OCCUPIED = 1  # Inside a building footprint
+    RESERVED = 2  # Footprint plus a one tile ring, no new building may spawn here
+    def __init__(self, grid_size):
+        self.grid_size = tuple(grid_size)
+        self.flags = np.zeros(self.grid_size, dtype=np.uint8)
+    @classmethod
+    def from_buildings(cls, grid_size, buildings):
+        occupancy = cls(grid_size)
+        for building in buildings:
+            occupancy.add_building(building)
+        return occupancy
+    def add_building(self, building):
+        # Called once per building when its footprint is finalized
+        if building.dimensions[0] == 0 or building.dimensions[1] == 0:
+            return
+        col, row = building.location
+        width, height = building.dimensions
+        self.flags[max(col - 1, 0):col + width + 1, max(row - 1, 0):row + height + 1] |= self.RESERVED
+        self.flags[col:col + width, row:row + height] |= self.OCCUPIED
+    def rect_free(self, col0, row0, col1, row1):
+        # No occupied tile inside the inclusive rectangle; placement only asks about one tile strips,
+        # so slicing is O(strip length) with no table to keep in sync
+        return not (self.flags[col0:col1 + 1, row0:row1 + 1] & self.OCCUPIED).any()
+class SpawnIndex():
+    # Spawnable tiles bucketed by zone band, heat filtered once per board
+    def __init__(self, heat_map, occupancy=None, zones=5):
+        heat_map = as_heat_map(heat_map)
+        cols, rows = heat_map.shape
+        first_bound, spawn_bound = heat_bounds()[3:]
+        self.zones = zones
+        self.zone_rows = [zone_band(zone, rows, zones) for zone in range(zones)]
+        self.cells = []  # Per zone list of (col, row) candidates
+        self.positions = []  # Per zone {(col, row): index into cells}
+        for start_row, end_row in self.zone_rows:
+            band = heat_map[:, start_row:end_row + 1]
+            mask = (first_bound < band) & (band < spawn_bound)
+            if occupancy is not None:
+                mask &= (occupancy.flags[:, start_row:end_row + 1] & OccupancyGrid.RESERVED) == 0
+            cells = [(col, row + start_row) for col, row in np.argwhere(mask).tolist()]
+            self.cells.append(cells)
+            self.positions.append({cell: i for i, cell in enumerate(cells)})
+    def available(self, zone):
+        return len(self.cells[zone])
+    def sample(self, zone, rng=random):
+        return rng.choice(self.cells[zone])
+    def discard(self, col, row):
+        # Bands share their boundary rows, so a tile can sit in two zones
+        cell = (col, row)
+        for zone, (start_row, end_row) in enumerate(self.zone_rows):
+            if not start_row <= row <= end_row:
+                continue
+            positions = self.positions[zone]
+            i = positions.pop(cell, None)
+            if i is None:
+                continue
+            cells = self.cells[zone]
+            last = cells.pop()
+            if i < len(cells):
+                # Swap the last candidate into the hole
+                cells[i] = last
+                positions[last] = i
+    def discard_building(self, building):
+        # Remove the reserved footprint plus ring of a finalized building
+        col, row = building.location
+        width, height = building.dimensions
+        for c in range(col - 1, col + width + 1):
+            for r in range(row - 1, row + height + 1):
+                self.discard(c, r)
+class NameRegistry():
+    # Unused building names per subject, drawn without replacement. Once every pool is empty,
+    # reuse() hands out defined names again with a number appended.
+    def __init__(self, subjects):
+        self.defined = {subject: [definition['name'] for definition in definitions] for subject, definitions in subjects.items()}
+        self.reused = {}  # name -> times handed out again
+        self.names = {}  # Per subject list of unused names
+        self.positions = {}  # Per subject {name: index into names}
+        self.subjects_of = {}  # name -> subjects whose pool lists it
+        for subject, definitions in subjects.items():
+            names = []
+            for definition in definitions:
+                name = definition['name']
+                if name not in self.subjects_of.setdefault(name, []):
+                    self.subjects_of[name].append(subject)
+                    names.append(name)
+            self.names[subject] = names
+            self.positions[subject] = {name: i for i, name in enumerate(names)}
+    def available(self, subject):
+        return len(self.names[subject])
+    def take(self, subject, rng=random):
+        names = self.names[subject]
+        if not names:
+            raise ValueError(f"No unused {subject} building names left")
+        name = names[rng.randrange(len(names))]
+        self.discard(name)
+        return name
+    def reuse(self, subject, rng=random):
+        name = rng.choice(self.defined[subject])
+        self.reused[name] = self.reused.get(name, 1) + 1
+        return f"{name} {self.reused[name]}"
+    def discard(self, name):
+        # A name can be listed under several subjects, so drop it from every pool
+        for subject in self.subjects_of.get(name, ()):
+            positions = self.positions[subject]
+            i = positions.pop(name, None)
+            if i is None:
+                continue
+            names = self.names[subject]
+            last = names.pop()
+            if i < len(names):
+                # Swap the last name into the hole
+                names[i] = last
+                positions[last] = i
+class AdjacencyGraph():
+    # Touching buildings in CSR form (indptr/indices into the building list),
+    # plus the shared wall of every pair as (orientation, line, start, end) in tile edges
+    def __init__(self, count, walls):
+        self.walls = walls  # {(i, j): wall} with i < j
+        neighbours = [[] for _ in range(count)]
+        for i, j in walls:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+        self.indptr = np.zeros(count + 1, dtype=np.int32)
+        self.indptr[1:] = np.cumsum([len(n) for n in neighbours])
+        self.indices = np.array([j for n in neighbours for j in sorted(n)], dtype=np.int32)
+    def neighbours(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+    def wall(self, i, j):
+        return self.walls[(i, j) if i < j else (j, i)]
+    def link(self, buildings):
+        # Fill Building.connections, neighbours in building list order
+        for i, building in enumerate(buildings):
+            building.connections = [buildings[j] for j in self.neighbours(i).tolist()]
+        return buildings
+class ZoneTracker():
+    # Tile and building counts per horizontal zone, updated once per finalized building
+    def __init__(self, rows, zones=5, max_tiles=300, max_buildings=4):
+        self.zones = zones
+        self.max_tiles = max_tiles  # A zone with this many building tiles is full
+        self.max_buildings = max_buildings  # A zone with this many buildings centred in it is full
+        self.rows = rows
+        self.zone_height = max(rows // zones, 1)
+        self.tile_counts = [0] * zones
+        self.building_counts = [0] * zones
+        # Shared with generate_building, which also flags zones that run out of spawn points
+        self.overpopulated = [False] * zones
+    def zone_of(self, row):
+        # The last zone absorbs the rows left over from uneven division
+        return min(row // self.zone_height, self.zones - 1)
+    def add_building(self, building):
+        # Skip if building hasn't been placed (dimensions are 0)
+        if building.dimensions[0] == 0 or building.dimensions[1] == 0:
+            return
+        width = building.dimensions[0]
+        start_row = building.location[1]
+        end_row = min(building.location[1] + building.dimensions[1], self.rows) - 1
+        row = start_row
+        while row <= end_row:
+            # Count a whole zone's worth of rows at a time
+            zone = self.zone_of(row)
+            zone_end = end_row if zone == self.zones - 1 else min(end_row, (zone + 1) * self.zone_height - 1)
+            self.tile_counts[zone] += (zone_end - row + 1) * width
+            row = zone_end + 1
+        self.building_counts[self.zone_of(building.location[1] + building.dimensions[1] // 2)] += 1
+        for zone in range(self.zones):
+            if self.tile_counts[zone] >= self.max_tiles or self.building_counts[zone] >= self.max_buildings:
+                self.overpopulated[zone] = True
+class NavigationGraph():
+    # Walkable campus as a weighted graph. Nodes are corridor tiles, room doors, stair landings and
+    # floor hubs (for floors without corridors), each placed at (building, floor, col, row) in world
+    # tiles. Corridor ends on the ground floor are entrances; outdoor walks join the entrances of
+    # different buildings. Routes are A* with a Manhattan plus stairs heuristic.
+    STAIR_COST = 4  # Per floor climbed
+    OUTDOOR_LINKS = 4  # Nearest foreign entrances each entrance gets a direct walk to
+    def __init__(self, buildings, cache_size=65536):
+        self.buildings = buildings
+        self.node_building = []
+        self.node_floor = []
+        self.node_col = []
+        self.node_row = []
+        self.edges = []  # Per node list of (neighbour, weight)
+        self.tiles = {}  # (floor, col, row) -> corridor node
+        self.rooms = {}  # (building, floor, room index) -> door node
+        self.stairs = {}  # (building, floor) -> landing node
+        self.entrances = []  # Ground floor nodes that open onto the campus
+        self.perimeter = []  # (node, col, row outside the wall) for corridor tiles on a wall
+        for i, building in enumerate(buildings):
+            self.add_building(i, building)
+        self.add_wall_links()
+        self.add_outdoor_links()
+        # Hot routes are answered from here instead of rerunning A*
+        self.route = lru_cache(maxsize=cache_size)(self.find_route)
+    def add_node(self, building, floor, col, row):
+        self.node_building.append(building)
+        self.node_floor.append(floor)
+        self.node_col.append(col)
+        self.node_row.append(row)
+        self.edges.append([])
+        return len(self.edges) - 1
+    def link(self, a, b, weight):
+        self.edges[a].append((b, weight))
+        self.edges[b].append((a, weight))
+    def add_building(self, i, building):
+        col0, row0 = building.location
+        width, height = building.dimensions
+        for floor in range(building.floors):
+            corridors = building.corridors[floor] if floor < len(building.corridors) else {"x": [], "y": []}
+            tiles = set()
+            for x in corridors["x"]:
+                tiles.update((col0 + x, row0 + row) for row in range(height))
+            for y in corridors["y"]:
+                tiles.update((col0 + col, row0 + y) for col in range(width))
+            tiles = sorted(tiles)
+            for col, row in tiles:
+                self.tiles[(floor, col, row)] = self.add_node(i, floor, col, row)
+            for col, row in tiles:
+                node = self.tiles[(floor, col, row)]
+                for neighbour in (self.tiles.get((floor, col + 1, row)), self.tiles.get((floor, col, row + 1))):
+                    if neighbour is not None:
+                        self.link(node, neighbour, 1)
+                # Corridors run wall to wall, so their ends sit on the building edge
+                outside = None
+                if row == row0:
+                    outside = (col, row - 1)
+                elif row == row0 + height - 1:
+                    outside = (col, row + 1)
+                elif col == col0:
+                    outside = (col - 1, row)
+                elif col == col0 + width - 1:
+                    outside = (col + 1, row)
+                if outside is not None:
+                    self.perimeter.append((node, floor, *outside))
+                    if floor == 0:
+                        self.entrances.append(node)
+            hub = None
+            if not tiles:
+                # Open plan or too narrow for corridors: rooms and stairs meet in the middle
+                hub = self.add_node(i, floor, col0 + width // 2, row0 + height // 2)
+                if floor == 0:
+                    self.entrances.append(hub)
+            for index, room in enumerate(building.rooms[floor]):
+                self.rooms[(i, floor, index)] = self.add_door(i, floor, room, building.location, hub)
+            if hub is not None:
+                landing = hub
+            elif corridors["x"] and corridors["y"]:
+                landing = self.tiles[(floor, col0 + corridors["x"][0], row0 + corridors["y"][0])]
+            else:
+                landing = self.tiles[(floor, *tiles[0])]
+            self.stairs[(i, floor)] = landing
+            if floor > 0:
+                self.link(landing, self.stairs[(i, floor - 1)], self.STAIR_COST)
+    def add_door(self, i, floor, room, origin, hub):
+        # Door on the first room tile that faces a corridor, else a walk to the nearest corridor tile
+        left, top = origin[0] + room.location[0], origin[1] + room.location[1]
+        right, bottom = left + room.dimensions[0] - 1, top + room.dimensions[1] - 1
+        if hub is not None:
+            door = self.add_node(i, floor, (left + right) // 2, (top + bottom) // 2)
+            self.link(door, hub, abs(self.node_col[door] - self.node_col[hub]) + abs(self.node_row[door] - self.node_row[hub]))
+            return door
+        for col in range(left, right + 1):
+            for row, outside in ((top, top - 1), (bottom, bottom + 1)):
+                corridor = self.tiles.get((floor, col, outside))
+                if corridor is not None:
+                    door = self.add_node(i, floor, col, row)
+                    self.link(door, corridor, 1)
+                    return door
+        for row in range(top, bottom + 1):
+            for col, outside in ((left, left - 1), (right, right + 1)):
+                corridor = self.tiles.get((floor, outside, row))
+                if corridor is not None:
+                    door = self.add_node(i, floor, col, row)
+                    self.link(door, corridor, 1)
+                    return door
+        door = self.add_node(i, floor, (left + right) // 2, (top + bottom) // 2)
+        col, row = self.node_col[door], self.node_row[door]
+        nearest = min((abs(c - col) + abs(r - row), node) for (f, c, r), node in self.tiles.items() if f == floor and self.node_building[node] == i)
+        self.link(door, nearest[1], nearest[0])
+        return door
+    def add_wall_links(self):
+        # Aligned corridors of touching buildings meet across the shared wall
+        for node, floor, col, row in self.perimeter:
+            other = self.tiles.get((floor, col, row))
+            if other is not None and node < other:
+                self.link(node, other, 1)
+    def add_outdoor_links(self):
+        if len(self.entrances) < 2:
+            return
+        entrances = np.array(self.entrances)
+        cols = np.array(self.node_col)[entrances]
+        rows = np.array(self.node_row)[entrances]
+        owners = np.array(self.node_building)[entrances]
+        distances = np.abs(cols[:, None] - cols[None, :]) + np.abs(rows[:, None] - rows[None, :])
+        distances[owners[:, None] == owners[None, :]] = np.iinfo(distances.dtype).max
+        linked = set()
+        def walk(a, b):
+            pair = (min(a, b), max(a, b))
+            if pair not in linked:
+                linked.add(pair)
+                self.link(int(entrances[a]), int(entrances[b]), int(distances[a, b]))
+        k = min(self.OUTDOOR_LINKS, len(entrances) - 1)
+        for a, nearest in enumerate(np.argpartition(distances, k - 1, axis=1)[:, :k].tolist()):
+            for b in nearest:
+                if owners[a] != owners[b]:
+                    walk(a, b)
+        # Kruskal over entrance pairs so every building is reachable even when clusters sit far apart
+        parent = list(range(len(self.buildings)))
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+        components = len(set(owners.tolist()))
+        for flat in np.argsort(distances, axis=None).tolist():
+            if components == 1:
+                break
+            a, b = divmod(flat, len(entrances))
+            root_a, root_b = find(int(owners[a])), find(int(owners[b]))
+            if root_a != root_b:
+                parent[root_a] = root_b
+                components -= 1
+                walk(a, b)
+    def heuristic(self, node, target):
+        return (abs(self.node_col[node] - self.node_col[target]) + abs(self.node_row[node] - self.node_row[target])
+                + self.STAIR_COST * abs(self.node_floor[node] - self.node_floor[target]))
+    def find_route(self, source, target):
+        """A* from source to target node: (path as a tuple of nodes, cost), or (None, inf) if unreachable"""
+        cols, rows, floors, edges = self.node_col, self.node_row, self.node_floor, self.edges
+        target_col, target_row, target_floor = cols[target], rows[target], floors[target]
+        stair_cost = self.STAIR_COST
+        best = {source: 0}
+        came_from = {}
+        heap = [(self.heuristic(source, target), 0, source)]
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == target:
+                path = [node]
+                while node in came_from:
+                    node = came_from[node]
+                    path.append(node)
+                return tuple(reversed(path)), cost
+            if cost > best[node]:
+                continue
+            for neighbour, weight in edges[node]:
+                new_cost = cost + weight
+                if new_cost < best.get(neighbour, new_cost + 1):
+                    best[neighbour] = new_cost
+                    came_from[neighbour] = node
+                    estimate = (abs(cols[neighbour] - target_col) + abs(rows[neighbour] - target_row)
+                                + stair_cost * abs(floors[neighbour] - target_floor))
+                    heapq.heappush(heap, (new_cost + estimate, new_cost, neighbour))
+        return None, float("inf")
+    def room_route(self, source, target):
+        """Route between two (building, floor, room index) keys"""
+        return self.route(self.rooms[source], self.rooms[target])
+    def shortest_tree(self, source):
+        # Plain Dijkstra over the whole graph: distances and the parent of each node (-1 for none)
+        distances = np.full(len(self.edges), np.inf)
+        parents = np.full(len(self.edges), -1, dtype=np.int32)
+        distances[source] = 0
+        heap = [(0, source)]
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > distances[node]:
+                continue
+            for neighbour, weight in self.edges[node]:
+                new_cost = cost + weight
+                if new_cost < distances[neighbour]:
+                    distances[neighbour] = new_cost
+                    parents[neighbour] = node
+                    heapq.heappush(heap, (new_cost, neighbour))
+        return distances, parents
+    def distances_from(self, source):
+        return self.shortest_tree(source)[0]
+    @cached_property
+    def building_distances(self):
+        # Walking distance between the ground floor landings of every pair of buildings.
+        # One Dijkstra per building, so only built when first read
+        landings = [self.stairs.get((i, 0)) for i in range(len(self.buildings))]
+        table = np.full((len(landings), len(landings)), np.inf)
+        for i, landing in enumerate(landings):
+            if landing is None:
+                continue
+            distances = self.distances_from(landing)
+            for j, other in enumerate(landings):
+                if other is not None:
+                    table[i, j] = distances[other]
+        return table
+class StudentSimulation():
+    # Every student is a row across NumPy arrays and the whole population advances one tick at a time.
+    # Students walk the navigation graph by next-hop tables (one row per destination door), spend
+    # "remaining" ticks on each edge, then stay in the room for a dwell time before picking a new one.
+    # ACTIVITIES: room identity -> (share of trips, (min, max) dwell ticks)
+    ACTIVITIES = {
+        "Classroom": (0.6, (40, 80)),
+        "Cafeteria": (0.15, (20, 40)),
+        "Library": (0.15, (20, 60)),
+        "Bathroom": (0.1, (3, 8)),
+    }
+    WALKING, IN_ROOM = 0, 1
+    def __init__(self, navigation, count, seed=0, grid_size=(75, 75)):
+        self.navigation = navigation
+        self.grid_size = grid_size
+        self.rng = np.random.default_rng(seed)
+        # Destination doors with the activity they serve
+        doors, activities = [], []
+        names = list(self.ACTIVITIES)
+        for (i, floor, index), door in navigation.rooms.items():
+            identity = navigation.buildings[i].rooms[floor][index].identity
+            if identity in self.ACTIVITIES:
+                doors.append(door)
+                activities.append(names.index(identity))
+        if not doors:
+            raise ValueError("Campus has no rooms students can go to")
+        self.doors = np.array(doors, dtype=np.int32)
+        activities = np.array(activities)
+        # Pick an activity by share, then a door of that kind uniformly
+        shares = np.array([self.ACTIVITIES[name][0] if (activities == k).any() else 0 for k, name in enumerate(names)])
+        self.door_weights = shares[activities] / np.bincount(activities, minlength=len(names))[activities]
+        self.door_weights /= self.door_weights.sum()
+        self.door_cumulative = np.cumsum(self.door_weights)
+        self.dwell_min = np.array([self.ACTIVITIES[names[k]][1][0] for k in activities], dtype=np.int32)
+        self.dwell_max = np.array([self.ACTIVITIES[names[k]][1][1] for k in activities], dtype=np.int32)
+        nodes = len(navigation.edges)
+        self.next_hop = np.empty((len(doors), nodes), dtype=np.int32)
+        self.hop_cost = np.empty((len(doors), nodes), dtype=np.int32)
+        for t, door in enumerate(doors):
+            distances, parents = navigation.shortest_tree(door)
+            # A node's Dijkstra parent from the door is its next step towards it; unreachable nodes stay put
+            reachable = parents >= 0
+            self.next_hop[t] = np.where(reachable, parents, np.arange(nodes))
+            costs = distances - distances[self.next_hop[t]]
+            costs[~reachable] = 0
+            self.hop_cost[t] = costs
+        self.node_col = np.array(navigation.node_col, dtype=np.int32)
+        self.node_row = np.array(navigation.node_row, dtype=np.int32)
+        self.node_floor = np.array(navigation.node_floor, dtype=np.int32)
+        # Flat views so a (target, node) lookup is one take on target * nodes + node
+        self.nodes = nodes
+        self.next_hop_flat = self.next_hop.ravel()
+        self.hop_cost_flat = self.hop_cost.ravel()
+        # Per student state; "remaining" counts down the current edge or the stay in a room
+        entrances = np.array(navigation.entrances, dtype=np.int32)
+        self.node = entrances[self.rng.integers(0, len(entrances), count)]
+        self.target = self.pick_targets(count)
+        self.goal = self.doors[self.target]
+        self.state = np.full(count, self.WALKING, dtype=np.uint8)
+        self.heading = np.empty(count, dtype=np.int32)
+        self.remaining = np.empty(count, dtype=np.int32)
+        self.route(np.arange(count))
+        self.ticks = 0
+    def pick_targets(self, count):
+        picks = np.searchsorted(self.door_cumulative, self.rng.random(count) * self.door_cumulative[-1], side="right")
+        return np.minimum(picks, len(self.doors) - 1).astype(np.int32)
+    def route(self, students):
+        # Next edge towards each student's target
+        lookup = self.target[students] * self.nodes + self.node[students]
+        self.heading[students] = self.next_hop_flat[lookup]
+        self.remaining[students] = self.hop_cost_flat[lookup]
+    def step(self, ticks=1):
+        for _ in range(ticks):
+            self.remaining -= 1
+            # Only students at the end of an edge or a stay have anything to do this tick
+            due = np.flatnonzero(self.remaining <= 0)
+            if not due.size:
+                self.ticks += 1
+                continue
+            in_room = self.state[due] == self.IN_ROOM
+            leaving = due[in_room]
+            walkers = due[~in_room]
+            self.node[walkers] = self.heading[walkers]
+            at_goal = self.node[walkers] == self.goal[walkers]
+            arrived = walkers[at_goal]
+            if arrived.size:
+                target = self.target[arrived]
+                self.state[arrived] = self.IN_ROOM
+                span = self.dwell_max[target] - self.dwell_min[target] + 1
+                self.remaining[arrived] = self.dwell_min[target] + (self.rng.random(arrived.size) * span).astype(np.int32)
+            if leaving.size:
+                self.target[leaving] = self.pick_targets(leaving.size)
+                self.goal[leaving] = self.doors[self.target[leaving]]
+                self.state[leaving] = self.WALKING
+                self.route(np.concatenate((walkers[~at_goal], leaving)))
+            else:
+                self.route(walkers[~at_goal])
+            self.ticks += 1
+        return self
+    def density(self, floor=None):
+        """Students per tile as a (cols, rows) array, on one floor or all of them"""
+        cols, rows = self.grid_size
+        node = self.node if floor is None else self.node[self.node_floor[self.node] == floor]
+        cells = self.node_col[node] * rows + self.node_row[node]
+        return np.bincount(cells, minlength=cols * rows)[:cols * rows].reshape(cols, rows)
+class Timetable():
+    # Class sections (subject, size, period) placed in Classroom rooms of buildings with that subject.
+    # Free rooms are indexed per (subject, period) as a capacity sorted list, so placing a section is
+    # a best fit bisect. Changes only touch their own (subject, period): a section that does not fit
+    # bumps one smaller occupant into another free room if it can, and removals retry the waiting list.
+    CAPACITY_PER_TILE = 3  # Students per tile of classroom floor
+    def __init__(self, buildings):
+        self.rooms = []  # Room id -> Room
+        self.capacity = []  # Room id -> seats
+        self.subject_rooms = {}  # Subject -> room ids
+        for building in buildings:
+            for floor_rooms in building.rooms:
+                for room in floor_rooms:
+                    if room.identity == "Classroom":
+                        self.subject_rooms.setdefault(building.subject, []).append(len(self.rooms))
+                        self.rooms.append(room)
+                        self.capacity.append(room.dimensions[0] * room.dimensions[1] * self.CAPACITY_PER_TILE)
+        self.free = {}  # (subject, period) -> sorted [(capacity, room id)] of free rooms
+        self.occupant = {}  # (room id, period) -> section id
+        self.sections = {}  # Section id -> (subject, size, period)
+        self.assignment = {}  # Section id -> room id
+        self.waiting = {}  # (subject, period) -> section ids that could not be placed
+        self.repairs = 0
+    def free_rooms(self, subject, period):
+        key = (subject, period)
+        if key not in self.free:
+            self.free[key] = sorted((self.capacity[room], room) for room in self.subject_rooms.get(subject, ()))
+        return self.free[key]
+    def take(self, section, room):
+        subject, _, period = self.sections[section]
+        free = self.free_rooms(subject, period)
+        del free[bisect_left(free, (self.capacity[room], room))]
+        self.occupant[(room, period)] = section
+        self.assignment[section] = room
+    def release(self, section):
+        subject, _, period = self.sections[section]
+        room = self.assignment.pop(section)
+        del self.occupant[(room, period)]
+        insort(self.free_rooms(subject, period), (self.capacity[room], room))
+    def best_fit(self, subject, size, period):
+        free = self.free_rooms(subject, period)
+        i = bisect_left(free, (size, -1))
+        return free[i][1] if i < len(free) else None
+    def place(self, section):
+        subject, size, period = self.sections[section]
+        room = self.best_fit(subject, size, period)
+        if room is not None:
+            self.take(section, room)
+            return True
+        # Repair: move a section out of a big enough room into a free room that still seats it
+        for room in sorted(self.subject_rooms.get(subject, ()), key=self.capacity.__getitem__):
+            if self.capacity[room] < size:
+                continue
+            other = self.occupant.get((room, period))
+            if other is None:
+                continue
+            spare = self.best_fit(subject, self.sections[other][1], period)
+            if spare is None:
+                continue
+            self.release(other)
+            self.take(other, spare)
+            self.take(section, room)
+            self.repairs += 1
+            return True
+        self.waiting.setdefault((subject, period), []).append(section)
+        return False
+    def add(self, section, subject, size, period):
+        self.sections[section] = (subject, size, period)
+        return self.place(section)
+    def remove(self, section):
+        subject, _, period = self.sections[section]
+        waiting = self.waiting.get((subject, period), [])
+        if section in self.assignment:
+            self.release(section)
+        elif section in waiting:
+            waiting.remove(section)
+        del self.sections[section]
+        # A freed room may now seat sections that were turned away, largest first
+        if waiting:
+            self.waiting[(subject, period)] = []
+            for other in sorted(waiting, key=lambda other: -self.sections[other][1]):
+                self.place(other)
+    def change(self, section, subject, size, period):
+        self.remove(section)
+        return self.add(section, subject, size, period)
+    def solve(self, sections):
+        """Place {section id: (subject, size, period)}, biggest sections first"""
+        for section, (subject, size, period) in sorted(sections.items(), key=lambda item: -item[1][1]):
+            self.add(section, subject, size, period)
+        return self
+    def unplaced(self):
+        return [section for waiting in self.waiting.values() for section in waiting]
+class Campus():
+    def __init__(self, seed, grid_size, heat_map=None, buildings=None, green_spaces=None):
+        self.seed = seed
+        self.grid_size = grid_size  # (cols, rows)
+        self.heat_map = heat_map
+        self.buildings = buildings if buildings is not None else []
+        self.green_spaces = green_spaces if green_spaces is not None else []
+        self.occupancy = OccupancyGrid(grid_size)
+        self.zones = None
+        self.adjacency = None
+    def structures(self):
+        # Same [buildings, green_spaces] pair that draw_board expects
+        return [self.buildings, self.green_spaces]
+    def to_record(self):
+        # Plain lists and dicts only, with buildings referenced by their index
+        index = {id(building): i for i, building in enumerate(self.buildings)}
+        return {
+            "seed": self.seed,
+            "grid_size": list(self.grid_size),
+            "buildings": [{
+                "id": i,
+                "name": building.name,
+                "subject": building.subject,
+                "floors": building.floors,
+                "location": list(building.location),
+                "dimensions": list(building.dimensions),
+                "connections": [index[id(other)] for other in building.connections],
+                "corridor_connections": [index[id(other)] for other in building.corridor_connections],
+                "corridors": [{"x": list(floor["x"]), "y": list(floor["y"])} for floor in building.corridors],
+                "rooms": [[{
+                    "name": room.name,
+                    "location": list(room.location),
+                    "dimensions": list(room.dimensions),
+                    "identity": room.identity,
+                } for room in floor] for floor in building.rooms],
+            } for i, building in enumerate(self.buildings)],
+            "green_spaces": [{
+                "name": green_space.name,
+                "location": list(green_space.location),
+                "dimensions": list(green_space.dimensions),
+            } for green_space in self.green_spaces],
+            # Shared walls of touching buildings, the same pairs as "connections"
+            "adjacency": [{
+                "buildings": [int(i), int(j)],
+                "orientation": orientation,
+                "line": int(line),
+                "start": int(start),
+                "end": int(end),
+            } for (i, j), (orientation, line, start, end) in sorted(self.adjacency.walls.items())] if self.adjacency is not None else [],
+        }
+class CampusSnapshot():
+    # Versioned binary campus file. After a fixed header and a section directory come
+    # aligned raw sections: the float32 heat map, fixed width struct tables joined by
+    # integer ids, and one UTF-8 string pool. Loading memory-maps the file and views
+    # every section in place, so nothing is parsed until it is read.
+    # Buildings with lazy interiors store their interior seed instead of rooms, and get
+    # their floors rebuilt from it on load.
+    MAGIC = b"CAMPSNAP"
+    VERSION = 2
+    HEADER = struct.Struct("<8sHHqII")  # magic, version, section count, seed, cols, rows
+    SECTION = struct.Struct("<8sQQ")  # name, byte offset, item count
+    ALIGN = 64
+    NO_STRING = 0xFFFFFFFF  # String id standing in for None
+    ROOMS_DEFERRED = 1  # Building flag: no room rows, rebuild floors from the interior seed
+    BUILDING = np.dtype([("name", "<u4"), ("subject", "<u4"), ("col", "<i4"), ("row", "<i4"), ("width", "<i4"), ("height", "<i4"),
+                         ("floors", "<u4"), ("first_room", "<u4"), ("room_count", "<u4"), ("first_corridor", "<u4"),
+                         ("corridor_count", "<u4"), ("first_link", "<u4"), ("link_count", "<u4"), ("interior_seed", "<u4"), ("flags", "<u4")])
+    ROOM = np.dtype([("building", "<u4"), ("floor", "<u4"), ("x", "<i4"), ("y", "<i4"), ("width", "<i4"), ("height", "<i4"),
+                     ("name", "<u4"), ("identity", "<u4")])
+    CORRIDOR = np.dtype([("building", "<u4"), ("floor", "<u4"), ("axis", "<u4"), ("offset", "<i4")])  # axis 0 = x, 1 = y
+    LINK = np.dtype([("source", "<u4"), ("target", "<u4"), ("kind", "<u4")])  # kind 0 = connection, 1 = corridor connection
+    GREEN_SPACE = np.dtype([("name", "<u4"), ("col", "<i4"), ("row", "<i4"), ("width", "<i4"), ("height", "<i4")])
+    def __init__(self, seed, grid_size, heat_map, buildings, rooms, corridors, links, green_spaces, string_offsets, string_data):
+        self.seed = seed
+        self.grid_size = grid_size
+        self.heat_map = heat_map
+        self.buildings = buildings
+        self.rooms = rooms
+        self.corridors = corridors
+        self.links = links
+        self.green_spaces = green_spaces
+        self.string_offsets = string_offsets
+        self.string_data = string_data
+    def string(self, string_id):
+        if string_id == self.NO_STRING:
+            return None
+        start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+        return bytes(self.string_data[start:end]).decode("utf-8")
+    @classmethod
+    def save(cls, campus, path):
+        strings = {}
+        def string_id(text):
+            if text is None:
+                return cls.NO_STRING
+            if text not in strings:
+                strings[text] = len(strings)
+            return strings[text]
+        index = {id(building): i for i, building in enumerate(campus.buildings)}
+        buildings = np.zeros(len(campus.buildings), dtype=cls.BUILDING)
+        rooms, corridors, links = [], [], []
+        for i, building in enumerate(campus.buildings):
+            first_room, first_corridor, first_link = len(rooms), len(corridors), len(links)
+            # Reading lazy rooms would build every floor, so only their seed is stored
+            flags = cls.ROOMS_DEFERRED if isinstance(building.rooms, LazyRooms) else 0
+            if not flags:
+                for floor, floor_rooms in enumerate(building.rooms):
+                    for room in floor_rooms:
+                        rooms.append((i, floor, *room.location, *room.dimensions, string_id(room.name), string_id(room.identity)))
+            for floor, floor_corridors in enumerate(building.corridors):
+                corridors.extend((i, floor, 0, offset) for offset in floor_corridors["x"])
+                corridors.extend((i, floor, 1, offset) for offset in floor_corridors["y"])
+            links.extend((i, index[id(other)], 0) for other in building.connections)
+            links.extend((i, index[id(other)], 1) for other in building.corridor_connections)
+            buildings[i] = (string_id(building.name), string_id(building.subject), *building.location, *building.dimensions, building.floors,
+                            first_room, len(rooms) - first_room, first_corridor, len(corridors) - first_corridor, first_link, len(links) - first_link,
+                            string_id(building.interior_seed), flags)
+        green_spaces = np.array([(string_id(g.name), *g.location, *g.dimensions) for g in campus.green_spaces], dtype=cls.GREEN_SPACE)
+        encoded = [text.encode("utf-8") for text in strings]
+        string_offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+        string_offsets[1:] = np.cumsum([len(text) for text in encoded])
+        heat_map = np.ascontiguousarray(campus.heat_map if campus.heat_map is not None else np.zeros(campus.grid_size), dtype="<f4")
+        sections = [
+            (b"heatmap", heat_map, heat_map.size),
+            (b"building", buildings, len(buildings)),
+            (b"room", np.array(rooms, dtype=cls.ROOM), len(rooms)),
+            (b"corridor", np.array(corridors, dtype=cls.CORRIDOR), len(corridors)),
+            (b"link", np.array(links, dtype=cls.LINK), len(links)),
+            (b"green", green_spaces, len(green_spaces)),
+            (b"stroffs", string_offsets, len(string_offsets)),
+            (b"strings", np.frombuffer(b"".join(encoded), dtype=np.uint8), sum(len(text) for text in encoded)),
+        ]
+        offset = cls.HEADER.size + cls.SECTION.size * len(sections)
+        directory = []
+        for name, array, count in sections:
+            offset = -(-offset // cls.ALIGN) * cls.ALIGN
+            directory.append((name, offset, count))
+            offset += array.nbytes
+        temp_path = path + f".{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(sections), campus.seed, *campus.grid_size))
+            for name, offset, count in directory:
+                f.write(cls.SECTION.pack(name, offset, count))
+            for (_, array, _), (_, offset, _) in zip(sections, directory):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(array.tobytes())
+        os.replace(temp_path, path)
+    @classmethod
+    def load(cls, path):
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, section_count, seed, cols, rows = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a campus snapshot")
+        if version != cls.VERSION:
+            raise ValueError(f"{path} is snapshot version {version}, expected {cls.VERSION}")
+        sections = {}
+        for i in range(section_count):
+            name, offset, count = cls.SECTION.unpack_from(data, cls.HEADER.size + i * cls.SECTION.size)
+            sections[name.rstrip(b"\0")] = (offset, count)
+        def view(name, dtype):
+            offset, count = sections[name]
+            return np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        return cls(seed, (cols, rows), view(b"heatmap", "<f4").reshape(cols, rows), view(b"building", cls.BUILDING), view(b"room", cls.ROOM),
+                   view(b"corridor", cls.CORRIDOR), view(b"link", cls.LINK), view(b"green", cls.GREEN_SPACE),
+                   view(b"stroffs", "<u4"), view(b"strings", np.uint8))
+    def to_campus(self, interiors=None):
+        # Rebuild full objects, for the viewer or anything else that needs the object graph.
+        # Deferred interiors become LazyRooms with an InteriorCache, otherwise they are built here.
+        campus = Campus(self.seed, self.grid_size, np.array(self.heat_map))
+        for row in self.buildings.tolist():
+            name, subject, col, top, width, height, floors = row[:7]
+            building = Building(self.string(name), (col, top), (width, height), subject=self.string(subject), floors=floors)
+            building.interior_seed = self.string(row[-2])
+            campus.buildings.append(building)
+        for building_id, floor, x, y, width, height, name, identity in self.rooms.tolist():
+            building = campus.buildings[building_id]
+            building.rooms[floor].append(Room(self.string(name), (x, y), (width, height), building, building.subject, self.string(identity)))
+        for building_id, floor, axis, offset in self.corridors.tolist():
+            campus.buildings[building_id].corridors[floor]["x" if axis == 0 else "y"].append(offset)
+        for building, flags in zip(campus.buildings, self.buildings["flags"].tolist()):
+            if not flags & self.ROOMS_DEFERRED:
+                continue
+            if interiors is not None:
+                building.rooms = LazyRooms(building, interiors)
+            else:
+                for floor in range(building.floors):
+                    building.generate_rooms(floor, building.floor_rng(floor))
+        for source, target, kind in self.links.tolist():
+            building = campus.buildings[source]
+            (building.connections if kind == 0 else building.corridor_connections).append(campus.buildings[target])
+        campus.green_spaces = [GreenSpace(self.string(name), (col, top), (width, height)) for name, col, top, width, height in self.green_spaces.tolist()]
+        campus.occupancy = OccupancyGrid.from_buildings(campus.grid_size, campus.buildings)
+        campus.adjacency = build_adjacency(campus.buildings)
+        return campus
+class LayoutCache():
+    # Finished campuses on disk, keyed by a hash of everything that decides the layout.
+    # Least recently used entries are evicted once the directory grows past max_bytes.
+    VERSION = 5  # Bump when generation changes so stale layouts stop matching
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024, verbose=False):
+        self.directory = directory if directory is not None else os.path.join(CACHE_DIR, "layouts")
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+    def key(self, seed, grid_size, building_count, scale, zone_settings):
+        digest = hashlib.sha256()
+        digest.update(repr((self.VERSION, seed, tuple(grid_size), building_count, scale, tuple(zone_settings))).encode())
+        with open(DEFINITIONS_PATH, "rb") as f:
+            digest.update(f.read())
+        return digest.hexdigest()
+    def path(self, key):
+        return os.path.join(self.directory, key + ".campus")
+    def load(self, key, interiors=None):
+        path = self.path(key)
+        try:
+            snapshot = CampusSnapshot.load(path)
+        except (OSError, ValueError, KeyError, struct.error):
+            self.misses += 1
+            self.report("miss", key)
+            return None
+        os.utime(path)  # Mark as recently used for eviction
+        self.hits += 1
+        self.report("hit", key)
+        return snapshot.to_campus(interiors)
+    def store(self, key, campus):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            CampusSnapshot.save(campus, self.path(key))
+            self.evict()
+        except OSError as error:
+            # Caching is an optimization; an unwritable directory just means the next run regenerates
+            self.report(f"store failed: {error}", key)
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".campus"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+    def report(self, outcome, key):
+        if self.verbose:
+            print(f"Layout cache {outcome} ({key[:12]}): {self.hits} hits, {self.misses} misses")
+
 
 def create_absolute_blocks(buildings):
     absolute_menus = {"buildings": {"menus": [], "layout_menus": []}}
@@ -798,59 +1809,88 @@ def create_absolute_blocks(buildings):
         
         absolute_menus["buildings"]["menus"].append(building_menu_block)
         absolute_buttons["buildings"]["buttons"].append(building_information_block)
-    # Layout menu
-    # Create a layout menu for each building that shows its physical layout with room buttons.
-    for building in buildings:
-        # Layout menu configuration
-        layout_screen_location = (70, 70)
-        layout_screen_size = (610, 610)  # Leaves some margin on the 750x750 display
-
-        # Find building actual size (width, height) in tiles or units
-        width, height = building.dimensions if hasattr(building, 'dimensions') else (10, 10)
-        if width == 0 or height == 0:
-            width, height = (10, 10)
-
-        # Determine scaling factors to fit the building into the layout menu area
-        scale_x = (layout_screen_size[0] - 60) / width
-        scale_y = (layout_screen_size[1] - 60) / height
-        scale = min(scale_x, scale_y)  # Uniform scaling (preserve aspect ratio)
-        margin_x = (layout_screen_size[0] - width * scale) // 2
-        margin_y = (layout_screen_size[1] - height * scale) // 2
-
-        building_draw_x = layout_screen_location[0] + margin_x
-        building_draw_y = layout_screen_location[1] + margin_y
-
-        # Rectangle representing the building shell
-        building_rect_block = Block(
-            structure=[],
-            location=(building_draw_x, building_draw_y),
-            dimensions=(width * scale, height * scale),
-            color=(160, 200, 160),
-            displayed=True, absolute=True, opacity=240, outline_width=4, outline_color=(40, 60, 40)
-        )
+    # Layout menus are created on demand by handle_button
+    return absolute_menus, absolute_buttons
+
+def create_layout_menu(building):
+    # Built the first time a building's layout is opened rather than for every building up front
+    # Layout menu configuration
+    layout_screen_location = (70, 70)
+    layout_screen_size = (610, 610)  # Leaves some margin on the 750x750 display
+
+    # Find building actual size (width, height) in tiles or units
+    width, height = building.dimensions if hasattr(building, 'dimensions') else (10, 10)
+    if width == 0 or height == 0:
+        width, height = (10, 10)
+
+    # Determine scaling factors to fit the building into the layout menu area
+    scale_x = (layout_screen_size[0] - 60) / width
+    scale_y = (layout_screen_size[1] - 60) / height
+    scale = min(scale_x, scale_y)  # Uniform scaling (preserve aspect ratio)
+    margin_x = (layout_screen_size[0] - width * scale) // 2
+    margin_y = (layout_screen_size[1] - height * scale) // 2
 
-        # Room buttons: Find rooms according to building.rooms or fallback
-        room_buttons = []
-        if hasattr(building, "rooms") and building.rooms:
-            for idx, room in enumerate(building.rooms):
-                # Each room should have a location and size within the building
-                rx, ry = getattr(room, "location", (0, 0))
-                rw, rh = getattr(room, "dimensions", (2, 2))
+    building_draw_x = layout_screen_location[0] + margin_x
+    building_draw_y = layout_screen_location[1] + margin_y
 
-                # Scale to fit layout area
-                room_x = building_draw_x + rx * scale
-                room_y = building_draw_y + ry * scale
-                room_w = rw * scale
-                room_h = rh * scale
+    # Rectangle representing the building shell
+    building_rect_block = Block(
+        structure=[],
+        location=(building_draw_x, building_draw_y),
+        dimensions=(width * scale, height * scale),
+        color=(160, 200, 160),
+        displayed=True, absolute=True, opacity=240, outline_width=4, outline_color=(40, 60, 40)
+    )
 
+    # Room buttons: Find rooms according to the ground floor of building.rooms or fallback
+    room_buttons = []
+    if hasattr(building, "rooms") and building.rooms and building.rooms[0]:
+        for idx, room in enumerate(building.rooms[0]):
+            # Each room should have a location and size within the building
+            rx, ry = getattr(room, "location", (0, 0))
+            rw, rh = getattr(room, "dimensions", (2, 2))
+
+            # Scale to fit layout area
+            room_x = building_draw_x + rx * scale
+            room_y = building_draw_y + ry * scale
+            room_w = rw * scale
+            room_h = rh * scale
+
+            room_button = Button(
+                label=getattr(room, "name", f"Room {idx+1}"),
+                label_size=14,
+                color=(120, 170, 190),
+                id=f"room_{building.name}_{idx}",
+                location=(room_x, room_y),
+                dimensions=(room_w, room_h),
+                object=room,
+                typing=False,
+                visible=True,
+                font_name="helvetica",
+                text_color=(0, 0, 0),
+                outline_width=2,
+                outline_color=(60, 90, 120),
+                absolute=True
+            )
+            room_buttons.append(room_button)
+    else:
+        # Fallback: show sample rooms in a grid
+        fallback_count_x = max(width // 3, 1)
+        fallback_count_y = max(height // 3, 1)
+        for i in range(fallback_count_y):
+            for j in range(fallback_count_x):
+                r_w = (width / fallback_count_x) * scale * 0.95
+                r_h = (height / fallback_count_y) * scale * 0.95
+                r_x = building_draw_x + j * (width * scale) / fallback_count_x + scale * 0.025
+                r_y = building_draw_y + i * (height * scale) / fallback_count_y + scale * 0.025
                 room_button = Button(
-                    label=getattr(room, "name", f"Room {idx+1}"),
+                    label=f"Room {i*fallback_count_x + j + 1}",
                     label_size=14,
                     color=(120, 170, 190),
-                    id=f"room_{building.name}_{idx}",
-                    location=(room_x, room_y),
-                    dimensions=(room_w, room_h),
-                    object=room,
+                    id=f"room_{building.name}_fake_{i}_{j}",
+                    location=(r_x, r_y),
+                    dimensions=(r_w, r_h),
+                    object=None,
                     typing=False,
                     visible=True,
                     font_name="helvetica",
@@ -860,161 +1900,549 @@ def create_absolute_blocks(buildings):
                     absolute=True
                 )
                 room_buttons.append(room_button)
-        else:
-            # Fallback: show sample rooms in a grid
-            fallback_count_x = max(width // 3, 1)
-            fallback_count_y = max(height // 3, 1)
-            for i in range(fallback_count_y):
-                for j in range(fallback_count_x):
-                    r_w = (width / fallback_count_x) * scale * 0.95
-                    r_h = (height / fallback_count_y) * scale * 0.95
-                    r_x = building_draw_x + j * (width * scale) / fallback_count_x + scale * 0.025
-                    r_y = building_draw_y + i * (height * scale) / fallback_count_y + scale * 0.025
-                    room_button = Button(
-                        label=f"Room {i*fallback_count_x + j + 1}",
-                        label_size=14,
-                        color=(120, 170, 190),
-                        id=f"room_{building.name}_fake_{i}_{j}",
-                        location=(r_x, r_y),
-                        dimensions=(r_w, r_h),
-                        object=None,
-                        typing=False,
-                        visible=True,
-                        font_name="helvetica",
-                        text_color=(0, 0, 0),
-                        outline_width=2,
-                        outline_color=(60, 90, 120),
-                        absolute=True
-                    )
-                    room_buttons.append(room_button)
-
-        # Label above the layout
-        title_block = Block(
-            structure=[[Text(f"{building.name} Layout", (0, 0, 0), (layout_screen_location[0]+10, layout_screen_location[1]-40), 30, "arial", absolute=True)]],
-            location=(layout_screen_location[0], layout_screen_location[1]-50),
-            dimensions=(layout_screen_size[0], 40),
-            color=(220, 230, 220),
-            displayed=True, absolute=True, opacity=0
-        )
 
-        # Compose all together: Background, Title, Building Rectangle, Room Buttons
-        layout_menu_block = Block(
-            structure=[
-                [title_block],
-                [building_rect_block],
-                room_buttons  # Flat: let main Block render child buttons as siblings at root
-            ],
-            location=layout_screen_location,
-            dimensions=layout_screen_size,
-            color=(240, 240, 220),
-            displayed=True, absolute=True, opacity=246, block_id=f"layout_menu_{building.name}", outline_width=4, outline_color=(40, 60, 40)
-        )
+    # Label above the layout
+    title_block = Block(
+        structure=[[Text(f"{building.name} Layout", (0, 0, 0), (layout_screen_location[0]+10, layout_screen_location[1]-40), 30, "arial", absolute=True)]],
+        location=(layout_screen_location[0], layout_screen_location[1]-50),
+        dimensions=(layout_screen_size[0], 40),
+        color=(220, 230, 220),
+        displayed=True, absolute=True, opacity=0
+    )
 
-        absolute_menus["buildings"]["layout_menus"].append(layout_menu_block)
-    return absolute_menus, absolute_buttons
+    # Compose all together: Background, Title, Building Rectangle, Room Buttons
+    layout_menu_block = Block(
+        structure=[
+            [title_block],
+            [building_rect_block],
+            room_buttons  # Flat: let main Block render child buttons as siblings at root
+        ],
+        location=layout_screen_location,
+        dimensions=layout_screen_size,
+        color=(240, 240, 220),
+        displayed=True, absolute=True, opacity=246, block_id=f"layout_menu_{building.name}", outline_width=4, outline_color=(40, 60, 40)
+    )
+    return layout_menu_block
+
+# Perlin tables from the noise package, so perlin_field matches pnoise2 bit for bit
+_PERLIN_PERM = np.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225,
+    140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148,
+    247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32,
+    57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175,
+    74, 165, 71, 134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122,
+    60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54,
+    65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169,
+    200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64,
+    52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212,
+    207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213,
+    119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9,
+    129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104,
+    218, 246, 97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241,
+    81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31, 181, 199, 106, 157,
+    184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93,
+    222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180,
+], dtype=np.int32)
+_PERLIN_TABLE = np.tile(_PERLIN_PERM, 4)  # Room for base offsets without wrapping
+_PERLIN_GRAD = np.array([(1, 1), (-1, 1), (1, -1), (-1, -1), (1, 0), (-1, 0), (1, 0), (-1, 0),
+                         (0, 1), (0, -1), (0, 1), (0, -1), (1, 0), (-1, 0), (0, -1), (0, 1)], dtype=np.float32)
+
+NOISE_CACHE_DIR = os.path.join(CACHE_DIR, "noise")
+# Noise fields already generated by this process
+_noise_cache = {}
+
+def perlin_noise2(x, y, repeat, base):
+    """Vectorized single octave of pnoise2 over float32 coordinate arrays"""
+    table = _PERLIN_TABLE
+    i = np.floor(np.fmod(x, repeat)).astype(np.int32)
+    j = np.floor(np.fmod(y, repeat)).astype(np.int32)
+    ii = np.fmod((i + 1).astype(np.float32), repeat).astype(np.int32)
+    jj = np.fmod((j + 1).astype(np.float32), repeat).astype(np.int32)
+    i = (i & 255) + base
+    j = (j & 255) + base
+    ii = (ii & 255) + base
+    jj = (jj & 255) + base
+
+    x = x - np.floor(x)
+    y = y - np.floor(y)
+    fx = x * x * x * (x * (x * np.float32(6) - np.float32(15)) + np.float32(10))
+    fy = y * y * y * (y * (y * np.float32(6) - np.float32(15)) + np.float32(10))
 
-def gen_board(grid_size, scale):
+    a = table[i]
+    b = table[ii]
+    def grad(corner, dx, dy):
+        g = _PERLIN_GRAD[table[table[corner]] & 15]
+        return dx * g[..., 0] + dy * g[..., 1]
+    one = np.float32(1)
+    top = grad(a + j, x, y)
+    top = top + fx * (grad(b + j, x - one, y) - top)
+    bottom = grad(a + jj, x, y - one)
+    bottom = bottom + fx * (grad(b + jj, x - one, y - one) - bottom)
+    return top + fy * (bottom - top)
+
+def perlin_field(grid_size, scale, octaves, persistence, lacunarity, base, batch_cols=256):
+    """Build a (cols, rows) float32 heat map in column batches"""
     cols, rows = grid_size
-    seed = randint(0, 100)
-    board_map = [[float(pnoise2(c/scale, r/scale, octaves=2, persistence=0.25,
-                              lacunarity=1.5, base=seed)+1)/2 
-            for r in range(rows)] for c in range(cols)]
-    return board_map
+    field = np.empty((cols, rows), dtype=np.float32)
+    row_coords = (np.arange(rows) / scale).astype(np.float32)
+    for start in range(0, cols, batch_cols):
+        end = min(start + batch_cols, cols)
+        x, y = np.meshgrid((np.arange(start, end) / scale).astype(np.float32), row_coords, indexing="ij")
+        freq = np.float32(1)
+        amp = np.float32(1)
+        max_amp = np.float32(0)
+        total = np.zeros(x.shape, dtype=np.float32)
+        for _ in range(octaves):
+            total += perlin_noise2(x * freq, y * freq, np.float32(1024) * freq, base) * amp
+            max_amp += amp
+            freq *= np.float32(lacunarity)
+            amp *= np.float32(persistence)
+        # pnoise2 hands back a double, so rescale to [0, 1] in double precision
+        field[start:end] = ((total / max_amp).astype(np.float64) + 1) / 2
+    return field
+
+def load_noise_field(grid_size, scale, octaves, persistence, lacunarity, base, use_disk=True):
+    """Return a cached noise field, generating and storing it on a miss"""
+    key = (base, scale, octaves, persistence, lacunarity, tuple(grid_size))
+    if key in _noise_cache:
+        return _noise_cache[key]
+    path = os.path.join(NOISE_CACHE_DIR, "{}_{}_{}_{}_{}_{}x{}.npy".format(*key[:5], *key[5]))
+    field = None
+    if use_disk and os.path.exists(path):
+        try:
+            field = np.load(path)
+        except (OSError, ValueError):
+            field = None  # Corrupt or partial file, regenerate below
+    if field is None:
+        field = perlin_field(grid_size, scale, octaves, persistence, lacunarity, base)
+        if use_disk:
+            temp_path = path + f".{os.getpid()}.tmp"
+            try:
+                os.makedirs(NOISE_CACHE_DIR, exist_ok=True)
+                with open(temp_path, "wb") as f:
+                    np.save(f, field)
+                os.replace(temp_path, path)
+            except OSError:
+                # Unwritable cache directory: keep the field in memory only
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    field.setflags(write=False)  # Shared between campuses
+    _noise_cache[key] = field
+    return field
+
+def heat_bounds(intervals=(0.3, 0.1, 0.075, 0.075, 0.425)):
+    # (fourth, third, second, first, spawn) cumulative heat thresholds
+    fourth_bound = intervals[0]
+    third_bound = fourth_bound + intervals[1]
+    second_bound = third_bound + intervals[2]
+    first_bound  = second_bound + intervals[3]
+    spawn_bound  = first_bound + intervals[4]
+    return fourth_bound, third_bound, second_bound, first_bound, spawn_bound
+
+def zone_band(zone, rows, zones=5):
+    # Inclusive row range a building focused on this zone may spawn in
+    return zone * rows // zones, min(zone + 1, zones - 1) * rows // zones
+
+def dilate(mask, radius):
+    # Square morphological dilation: a tile is set if any tile within radius (Chebyshev) is set
+    cols, rows = mask.shape
+    size = 2 * radius + 1
+    padded = np.zeros((cols + size, rows + size), dtype=np.int32)
+    padded[radius + 1:radius + 1 + cols, radius + 1:radius + 1 + rows] = mask
+    table = padded.cumsum(axis=0).cumsum(axis=1)
+    window = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+    return (window > 0).astype(np.uint8)
+
+def as_heat_map(board_map):
+    """Accept either a heat map array or the old list-of-lists board"""
+    return np.asarray(board_map, dtype=np.float32)
+
+def gen_board(grid_size, scale, octaves=2, persistence=0.25, lacunarity=1.5, use_cache=True, rng=random):
+    seed = rng.randint(0, 100)
+    return load_noise_field(grid_size, scale, octaves, persistence, lacunarity, seed, use_disk=use_cache)
          
 
-def place_buildings(board_map):
+def place_buildings(board_map, building_count=20, occupancy=None, zone_tracker=None, rng=random):
+    board_map = as_heat_map(board_map)
+    if occupancy is None:
+        occupancy = OccupancyGrid(board_map.shape)
+    if zone_tracker is None:
+        zone_tracker = ZoneTracker(board_map.shape[1])
+    spawn_index = SpawnIndex(board_map, occupancy, zone_tracker.zones)
+    heat_bands = HeatBands(board_map)
     buildings = []
-    for i in range(20):
+    for i in range(building_count):
         buildings.append(Building(name=f"Building {i}"))
-    assign_buildings(buildings)
-    # Find focus zone
-    def get_zones(buildings, board_map):
-        overpopulated = [False, False, False, False, False]
-        focus = 0
-        # Calculate zone heights and tile distribution for 5 equal-height bands
-        rows = len(board_map)
-        zone_height = rows // 5
-        zone_tile_counts = [0, 0, 0, 0, 0]
-        zone_building_counts = [0, 0, 0, 0, 0]
-        for building in buildings:
-            # Skip if building hasn't been placed yet (dimensions are 0)
-            if building.dimensions[0] == 0 or building.dimensions[1] == 0:
-                continue
-            start_row = building.location[1]
-            end_row = building.location[1] + building.dimensions[1] - 1
-            for r in range(start_row, end_row + 1):
-                # which zone does this row belong to?
-                for r in range(start_row, end_row + 1):
-                    if r >= rows:  # Safety check
-                        break
-                    # Calculate zone explicitly to handle uneven division
-                    zone = min(r // zone_height, 4)
-                    # But ensure we don't go beyond rows
-                    if zone >= 5:
-                        zone = 4
-                    zone_tile_counts[zone] += 1
-            zone = min(((building.location[1] + (building.dimensions[1] // 2)) // zone_height), 4)
-            zone_building_counts[zone] += 1
-        # Now, zone_tile_counts holds the total number of tiles in each horizontal zone (0 to 4)
-        overpopulated = [False, False, False, False, False]
-        for i in range(len(overpopulated)):
-            if zone_tile_counts[i] >= 300:
-                overpopulated[i] = True
-            if zone_building_counts[i] >= 4:
-                overpopulated[i] = True
-        return overpopulated
-         # no remaining spots
-    to_remove = []
+    assign_buildings(buildings, rng)
     for building in buildings:
-        building.generate_building(board_map, buildings, get_zones(buildings, board_map))
-        if building.dimensions[0] == 0 or building.dimensions[1] == 0:
-            to_remove.append(building)
-    for building in to_remove:
-        buildings.remove(building) # remove building from list
+        building.generate_building(board_map, buildings, zone_tracker.overpopulated, occupancy=occupancy, spawn_index=spawn_index, heat_bands=heat_bands, rng=rng)
+        zone_tracker.add_building(building)
+    # Drop buildings that never found room
+    buildings = [building for building in buildings if building.dimensions[0] != 0 and building.dimensions[1] != 0]
     return buildings
 
-def place_green_spaces(board_map, buildings):
+def place_green_spaces(board_map, buildings, rng=random):
     green_spaces = []
-    for i in range(randint(10, 15)):
+    for i in range(rng.randint(10, 15)):
         green_spaces.append(GreenSpace(name=f"Green Space {i}", location=(0, 0), dimensions=(0, 0)))
+    free_space = FreeSpace(as_heat_map(board_map).shape, buildings)
     for green_space in green_spaces:
-        green_space.generate_green_space(board_map, green_spaces, buildings)
+        green_space.generate_green_space(board_map, green_spaces, buildings, free_space=free_space, rng=rng)
     return green_spaces
 
+def build_adjacency(buildings):
+    """Find every pair of touching buildings with one sweep over shared edge lines"""
+    # Buildings keyed by the line their south / east edge sits on, as (start, end, index) spans
+    by_south = {}
+    by_east = {}
+    for i, building in enumerate(buildings):
+        if building.dimensions[0] == 0 or building.dimensions[1] == 0:
+            continue  # Skip unplaced buildings
+        west, north = building.location
+        east, south = west + building.dimensions[0], north + building.dimensions[1]
+        by_south.setdefault(south, []).append((west, east, i))
+        by_east.setdefault(east, []).append((north, south, i))
+    # Spans on one line never overlap, so sorting by start also sorts them by end
+    lines = {}
+    for key, index in (("south", by_south), ("east", by_east)):
+        for line, spans in index.items():
+            spans.sort()
+            lines[(key, line)] = (spans, [span[0] for span in spans], [span[1] for span in spans])
+    def touching(key, line, start, end):
+        # Spans on the line with span_start <= end and span_end >= start (corners count)
+        if (key, line) not in lines:
+            return []
+        spans, starts, ends = lines[(key, line)]
+        return spans[bisect_left(ends, start):bisect_right(starts, end)]
+    walls = {}
+    for i, building in enumerate(buildings):
+        if building.dimensions[0] == 0 or building.dimensions[1] == 0:
+            continue
+        west, north = building.location
+        east, south = west + building.dimensions[0], north + building.dimensions[1]
+        # Neighbours whose south edge is our north edge, then whose east edge is our west edge
+        for other_west, other_east, j in touching("south", north, west, east):
+            walls.setdefault((min(i, j), max(i, j)), ("horizontal", north, max(west, other_west), min(east, other_east)))
+        for other_north, other_south, j in touching("east", west, north, south):
+            walls.setdefault((min(i, j), max(i, j)), ("vertical", west, max(north, other_north), min(south, other_south)))
+    return AdjacencyGraph(len(buildings), walls)
+
 def connect_buildings(buildings):
-    for building in buildings:
-        building.make_connections(buildings)
+    build_adjacency(buildings).link(buildings)
     return buildings
 
-def assign_buildings(buildings):
+_building_definitions = None
+
+def load_building_definitions():
+    global _building_definitions
+    # Parsed once per process; every assignment pass indexes the same definitions
+    if _building_definitions is None:
+        with open(DEFINITIONS_PATH, 'r') as f:
+            _building_definitions = json.load(f)
+    return _building_definitions
+
+def assign_buildings(buildings, rng=random):
     all_subjects = ["Math", "Science", "History", "English", "Language", "PE", "Art", "Music", 
     "Theater", "Computer Science", "Cafeteria", "Library"]
-    with open('building_definitions.json', 'r') as f:
-        building_definitions = json.load(f)
-    buildings_sorted_subject = building_definitions['subjects']
+    registry = NameRegistry(load_building_definitions()['subjects'])
     for i, building in enumerate(buildings):
         if i < 12:
             subject = all_subjects[i]
         else:
-            subject = all_subjects[randint(0, len(all_subjects) - 1)]
-        building.assign_building(buildings_sorted_subject, subject, buildings)
+            # Only subjects with names left; the same list as all_subjects until a pool runs dry
+            subjects = [subject for subject in all_subjects if registry.available(subject)]
+            if not subjects:
+                if not registry.reused:
+                    warnings.warn(f"Ran out of building names after {i} buildings, numbering repeated names")
+                subject = all_subjects[rng.randint(0, len(all_subjects) - 1)]
+                building.assign_building(registry, subject, rng, name=registry.reuse(subject, rng))
+                continue
+            subject = subjects[rng.randint(0, len(subjects) - 1)]
+        building.assign_building(registry, subject, rng)
     return buildings
 
-def make_building_corridors(buildings):
-    for building in buildings:
-        for floor in range(building.floors):
-            building.generate_corridors(floor)
-    for building in buildings:
-        for floor in range(building.floors):
-            building.generate_corridors(floor)
+def make_building_corridors(buildings, rng=random):
+    # Ground floor corridors, copied to the floors above. Each building is seeded once in list order
+    # (aligned to the neighbours seeded before it, random otherwise), then a worklist keeps aligning
+    # buildings whose neighbours gained corridors until nothing changes. Corridors only ever get added,
+    # so this reaches a fixed point. Per axis a corridor set is an int bitmask, bit i = offset i.
+    open_plan = ["Cafeteria", "Library", "PE", "Theater"]
+    index = {id(building): i for i, building in enumerate(buildings)}
+    masks = [[0, 0] for _ in buildings]  # [x corridors, y corridors]
+    def shared_axis(building, other):
+        # Corridors cross a left/right wall along y and a top/bottom wall along x
+        if building.location[0] + building.dimensions[0] == other.location[0] or building.location[0] == other.location[0] + other.dimensions[0]:
+            return 1
+        if building.location[1] + building.dimensions[1] == other.location[1] or building.location[1] == other.location[1] + other.dimensions[1]:
+            return 0
+        return None
+    def align(i):
+        # Adopt every neighbour corridor that lands inside this building without crowding one it has
+        building = buildings[i]
+        changed = False
+        for other in building.connections:
+            axis = shared_axis(building, other)
+            if axis is None:
+                continue
+            offset = building.location[axis] - other.location[axis]
+            limit = building.dimensions[axis] - 1
+            corridors = masks[index[id(other)]][axis]
+            while corridors:
+                lowest = corridors & -corridors
+                corridors ^= lowest
+                proposition = lowest.bit_length() - 1 - offset
+                if 0 < proposition < limit and not masks[i][axis] & (0b111 << (proposition - 1)):
+                    masks[i][axis] |= 1 << proposition
+                    changed = True
+                    if other not in building.corridor_connections:
+                        building.corridor_connections.append(other)
+        return changed
+    for i, building in enumerate(buildings):
+        if building.subject in open_plan:
+            continue
+        align(i)
+        for axis in (0, 1):
+            if not masks[i][axis]:
+                if building.dimensions[axis] < 3:
+                    break
+                masks[i][axis] = 1 << rng.randint(1, building.dimensions[axis] - 2)
+    # Only buildings with a neighbour seeded after them have anything left to pick up
+    pending = deque()
+    for i, building in enumerate(buildings):
+        if building.subject not in open_plan and any(index[id(other)] > i and other.subject not in open_plan for other in building.connections):
+            pending.append(i)
+    queued = set(pending)
+    while pending:
+        i = pending.popleft()
+        queued.discard(i)
+        if not align(i):
+            continue
+        for other in buildings[i].connections:
+            j = index[id(other)]
+            if j not in queued and other.subject not in open_plan:
+                queued.add(j)
+                pending.append(j)
+    for building, (x_mask, y_mask) in zip(buildings, masks):
+        x = [offset for offset in range(x_mask.bit_length()) if x_mask >> offset & 1]
+        y = [offset for offset in range(y_mask.bit_length()) if y_mask >> offset & 1]
+        building.corridors = [{"x": x.copy(), "y": y.copy()} for _ in range(building.floors)]
     return buildings
 
-def make_rooms(buildings):
-    for building in buildings:
+def make_rooms(buildings, seed, interiors=None):
+    # Eager by default; with an InteriorCache, floors are only built when something reads them
+    for i, building in enumerate(buildings):
+        building.interior_seed = f"{seed}:{i}"
+        if interiors is not None:
+            building.rooms = LazyRooms(building, interiors)
+            continue
         for floor in range(building.floors):
-            building.generate_rooms(floor)
+            building.generate_rooms(floor, building.floor_rng(floor))
     return buildings
 
+def generate_campus(seed=None, grid_size=(75, 75), building_count=20, scale=6, zone_tracker=None, interiors=None):
+    """Generate a full campus without touching the display"""
+    if seed is None:
+        seed = random.randrange(2**32)
+    # Every stage draws from this one generator, so the seed alone decides the campus
+    rng = random.Random(seed)
+    campus = Campus(seed, grid_size)
+    campus.heat_map = gen_board(grid_size, scale, rng=rng)
+    campus.zones = zone_tracker if zone_tracker is not None else ZoneTracker(grid_size[1])
+    campus.buildings = place_buildings(campus.heat_map, building_count, campus.occupancy, campus.zones, rng)
+    campus.green_spaces = place_green_spaces(campus.heat_map, campus.buildings, rng)
+
+    # Further information about buildings
+    campus.adjacency = build_adjacency(campus.buildings)
+    campus.adjacency.link(campus.buildings)
+    # Reassign after placement so every subject survives the removal of unplaced buildings
+    assign_buildings(campus.buildings, rng)
+    make_building_corridors(campus.buildings, rng)
+    # Rooms come from per-floor generators, so lazy and eager interiors match
+    make_rooms(campus.buildings, seed, interiors)
+    return campus
+
+def load_or_generate_campus(seed=None, grid_size=(75, 75), building_count=20, scale=6, zone_settings=(5, 300, 4), cache=None, interiors=None):
+    """Return the cached campus for these settings, generating and storing it on a miss"""
+    if seed is None:
+        seed = random.randrange(2**32)
+    zone_tracker = ZoneTracker(grid_size[1], *zone_settings)
+    if cache is None:
+        return generate_campus(seed, grid_size, building_count, scale, zone_tracker, interiors)
+    key = cache.key(seed, grid_size, building_count, scale, zone_settings)
+    campus = cache.load(key, interiors)
+    if campus is None:
+        campus = generate_campus(seed, grid_size, building_count, scale, zone_tracker, interiors)
+        cache.store(key, campus)
+    return campus
+
+def generate_campus_record(job):
+    """Worker entry point: (seed, grid_size, building_count, zone settings) -> campus record"""
+    campus_seed, grid_size, building_count, zones, zone_tiles, zone_buildings = job
+    zone_tracker = ZoneTracker(grid_size[1], zones, zone_tiles, zone_buildings)
+    return generate_campus(campus_seed, grid_size, building_count, zone_tracker=zone_tracker).to_record()
+
+def iter_campus_records(seeds, grid_size=(75, 75), building_count=20, zones=5, zone_tiles=300, zone_buildings=4, workers=1):
+    """Yield one campus record per seed, in seed order, generating on a process pool when workers > 1"""
+    jobs = ((campus_seed, tuple(grid_size), building_count, zones, zone_tiles, zone_buildings) for campus_seed in seeds)
+    if workers <= 1:
+        for job in jobs:
+            yield generate_campus_record(job)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        # A window of at most 2 * workers jobs in flight: a slow consumer holds generation back
+        # instead of finished records piling up in the parent (imap buffers them without limit)
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.apply_async(generate_campus_record, (job,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def run_batch(count, start_seed=0, grid_size=(75, 75), building_count=20, zones=5, zone_tiles=300, zone_buildings=4, workers=1):
+    """Generate campuses for count consecutive seeds and report throughput"""
+    start = time.perf_counter()
+    placed = 0
+    seeds = range(start_seed, start_seed + count)
+    for record in iter_campus_records(seeds, grid_size, building_count, zones, zone_tiles, zone_buildings, workers):
+        placed += len(record["buildings"])
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"Generated {count} campuses ({placed} buildings) on {workers} worker(s) in {elapsed:.2f}s: {rate:.1f} campuses/sec")
+    return rate
+
+def export_campuses(path, seeds, grid_size=(75, 75), building_count=20, zones=5, zone_tiles=300, zone_buildings=4, workers=1, compress=None):
+    """Stream one JSON campus record per line to path, gzipped if compress (default: path ends in .gz)"""
+    if compress is None:
+        compress = path.endswith(".gz")
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, "wt", encoding="utf-8") as f:
+        # Each record is written and dropped before the next one is generated
+        for record in iter_campus_records(seeds, grid_size, building_count, zones, zone_tiles, zone_buildings, workers):
+            f.write(json.dumps(record, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+    return count
+
+def unslotted(cls):
+    # Same class with a per-instance __dict__, for measuring what __slots__ saves
+    namespace = {key: value for key, value in vars(cls).items() if key != "__slots__" and key not in cls.__slots__}
+    return type(cls.__name__, (), namespace)
+
+def check_lazy_interiors(count=5, seed=0, max_floors=3):
+    """Compare lazy and eager interiors for count seeds; returns the seeds that differ"""
+    mismatches = []
+    for campus_seed in range(seed, seed + count):
+        expected = generate_campus(campus_seed).to_record()
+        # A tiny cache read back to front forces evictions and rebuilds out of generation order
+        lazy = generate_campus(campus_seed, interiors=InteriorCache(max_floors))
+        for building in reversed(lazy.buildings):
+            for floor in reversed(range(building.floors)):
+                building.rooms[floor]
+        # A lazy campus must also survive a snapshot, which stores seeds instead of rooms
+        path = os.path.join(tempfile.gettempdir(), f"lazy_check_{os.getpid()}.campus")
+        CampusSnapshot.save(lazy, path)
+        reloaded = CampusSnapshot.load(path).to_campus(InteriorCache(max_floors))
+        os.remove(path)
+        if lazy.to_record() != expected or reloaded.to_record() != expected:
+            mismatches.append(campus_seed)
+    print(f"Lazy interiors: {count - len(mismatches)} of {count} seeds match eager generation")
+    return mismatches
+
+def memory_benchmark(building_count=10000, floors=4, seed=0):
+    """Trace the memory of building_count buildings with floors of rooms, slotted vs plain classes"""
+    template = generate_campus(seed)
+    sources = [building for building in template.buildings if building.rooms[0]]
+    def build(building_cls, room_cls, green_space_cls):
+        buildings = []
+        for i in range(building_count):
+            source = sources[i % len(sources)]
+            (col, row), (width, height) = source.location, source.dimensions
+            building = building_cls(f"{source.name} {i}", (col, row), (width, height), subject=source.subject, floors=floors)
+            building.corridors = [{"x": list(source.corridors[0]["x"]), "y": list(source.corridors[0]["y"])} for _ in range(floors)]
+            for floor in range(floors):
+                for room in source.rooms[0]:
+                    (x, y), (w, h) = room.location, room.dimensions
+                    building.rooms[floor].append(room_cls(f"{room.name}{floor}", (x, y), (w, h), building, building.subject, room.identity))
+            buildings.append(building)
+        green_spaces = [green_space_cls(f"Green {i}", (i, i), (3, 3)) for i in range(building_count // 4)]
+        return buildings, green_spaces
+    results = {}
+    for label, classes in (("dict", (unslotted(Building), unslotted(Room), unslotted(GreenSpace))), ("slots", (Building, Room, GreenSpace))):
+        tracemalloc.start()
+        structures = build(*classes)
+        results[label] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del structures
+    rooms = building_count * floors * sum(len(source.rooms[0]) for source in sources) // len(sources)
+    print(f"{building_count} buildings, {floors} floors, ~{rooms} rooms: "
+          f"dict {results['dict'] / 2**20:.1f} MB, slots {results['slots'] / 2**20:.1f} MB "
+          f"({1 - results['slots'] / results['dict']:.0%} smaller)")
+    return results
+
+def route_benchmark(queries=100000, seed=0, distinct=2000):
+    """Time navigation graph build, cold A* routes and a stream of repeated (cached) route queries"""
+    campus = generate_campus(seed)
+    start = time.perf_counter()
+    navigation = NavigationGraph(campus.buildings)
+    built = time.perf_counter() - start
+    rng = random.Random(seed)
+    rooms = list(navigation.rooms)
+    pairs = [(rng.choice(rooms), rng.choice(rooms)) for _ in range(distinct)]
+    start = time.perf_counter()
+    for source, target in pairs:
+        navigation.room_route(source, target)
+    cold = time.perf_counter() - start
+    stream = [pairs[rng.randrange(distinct)] for _ in range(queries)]
+    start = time.perf_counter()
+    for source, target in stream:
+        navigation.room_route(source, target)
+    hot = time.perf_counter() - start
+    print(f"Navigation graph: {len(navigation.edges)} nodes in {built * 1000:.1f} ms")
+    print(f"{distinct} cold routes: {distinct / cold:.0f} routes/sec; {queries} cached queries: {queries / hot:.0f} queries/sec")
+    return queries / hot
+
+def student_benchmark(students=50000, ticks=1000, seed=0):
+    """Time the student simulation on a generated campus"""
+    campus = generate_campus(seed)
+    start = time.perf_counter()
+    simulation = StudentSimulation(NavigationGraph(campus.buildings), students, seed, campus.grid_size)
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    simulation.step(ticks)
+    elapsed = time.perf_counter() - start
+    print(f"{students} students over {len(simulation.doors)} rooms: setup {setup:.2f}s, {ticks / elapsed:.0f} ticks/sec "
+          f"({students * ticks / elapsed / 1e6:.1f}M student updates/sec)")
+    return ticks / elapsed
+
+def timetable_benchmark(periods=8, load=0.85, seed=0):
+    """Solve random timetables on growing campuses and time a run of incremental edits on each"""
+    sizes = ((75, 75), (150, 150), (250, 250))
+    for grid_size in sizes:
+        zones = max(5, grid_size[1] // 15)
+        campus = generate_campus(seed, grid_size, building_count=zones * 6, zone_tracker=ZoneTracker(grid_size[1], zones, 300, 6))
+        timetable = Timetable(campus.buildings)
+        rng = random.Random(seed)
+        sections = {}
+        for subject, rooms in timetable.subject_rooms.items():
+            seats = sorted(timetable.capacity[room] for room in rooms)
+            for period in range(periods):
+                for _ in range(int(len(rooms) * load)):
+                    sections[len(sections)] = (subject, rng.randint(10, max(10, rng.choice(seats))), period)
+        start = time.perf_counter()
+        timetable.solve(sections)
+        solved = time.perf_counter() - start
+        start = time.perf_counter()
+        edits = min(1000, len(sections))
+        for section in rng.sample(list(sections), edits):
+            subject, size, period = sections[section]
+            timetable.change(section, subject, max(10, size + rng.randint(-5, 5)), rng.randrange(periods))
+        edited = time.perf_counter() - start
+        print(f"{grid_size[0]}x{grid_size[1]}: {len(campus.buildings)} buildings, {len(timetable.rooms)} classrooms, "
+              f"{len(sections)} sections solved in {solved * 1000:.1f} ms ({len(timetable.unplaced())} unplaced, {timetable.repairs} repairs); "
+              f"{edits} edits in {edited * 1000:.1f} ms")
+
 def create_building_buttons(buildings, tile_size):
     global building_labels
     map_buttons = []
@@ -1038,41 +2466,98 @@ def create_building_buttons(buildings, tile_size):
 
 
 # Draw the board
-def draw_board(screen, structures, floor, mode):
-    # Fill window with very dark green background
+def draw_board(screen, structures, floor, mode, density=None):
+    # Static campus from the cached chunks under the camera
+    _world_layer.draw(screen, structures, floor, mode)
+    # Buttons in view showing a hover or press color are drawn live on top, plus any label they would cover
+    live = []
+    for kind, item in _world_layer.grid.query(camera_rect(screen)):
+        if kind == "building" and mode == "normal" and item.button.color != item.button.normal_color:
+            item.button.render(screen)
+            live.append(pygame.Rect(item.button.location, item.button.dimensions))
+        elif kind == "label":
+            rect = pygame.Rect(item.location, item.dimensions)
+            if item.color != item.normal_color or rect.collidelist(live) != -1:
+                item.render(screen)
+                live.append(rect)
+    if density is not None:
+        draw_density(screen, density)
+
+def camera_rect(screen):
+    """The part of the world the screen shows, in world pixels"""
+    return pygame.Rect(round(camera_offset[0]), round(camera_offset[1]), screen.get_width(), screen.get_height())
+
+def label_buttons():
+    # The name buttons inside the building label blocks
+    return [element for building_label in building_labels for line in building_label.structure for element in line]
+
+def buttons_in_view(structures, screen):
+    """Map buttons whose world rect intersects the screen"""
+    buttons = []
+    for kind, item in _world_layer.sync(structures).query(camera_rect(screen)):
+        if kind == "building":
+            buttons.append(item.button)
+        elif kind == "label":
+            buttons.append(item)
+    return buttons
+
+def draw_world(screen, items, floor, mode):
+    # Static scenery for (kind, object) items from the spatial grid, in draw order
+    # Fill with very dark green background
     screen.fill((10, 35, 10))
-    
-    # Draw gray map area (75x75 grid = 750x750 pixels)
-    map_size = 75 * 10  # 750 pixels
-    map_world_x, map_world_y = 0, 0
-    map_screen_x, map_screen_y = world_to_screen(map_world_x, map_world_y)
-    pygame.draw.rect(screen, (70, 70, 70), (map_screen_x, map_screen_y, map_size, map_size))
-    
-    buildings = structures[0]
-    green_spaces = structures[1]
-    scale = 1
+    for kind, item in items:
+        if kind == "map":
+            # Draw gray map area (75x75 grid = 750x750 pixels)
+            map_size = 75 * 10  # 750 pixels
+            map_screen_x, map_screen_y = world_to_screen(0, 0)
+            pygame.draw.rect(screen, (70, 70, 70), (map_screen_x, map_screen_y, map_size, map_size))
+        elif kind == "building":
+            item.render(screen, floor, mode)
+        elif kind == "green":
+            item.render(screen)
+        elif kind == "label":
+            item.render(screen)
 
-    # Building set-up
-    for building in buildings:
-        building.render(screen, floor, mode)
-    for green_space in green_spaces:
-        green_space.render(screen)
-    for building_label in building_labels:
-        building_label.render(screen)
-        
+def draw_density(screen, density):
+    # Students per tile as a translucent overlay from yellow (few) to red (crowded); empty tiles stay clear
+    # Only the tiles in view are drawn
+    view = camera_rect(screen)
+    col0, row0 = max(0, view.left // 10), max(0, view.top // 10)
+    col1, row1 = min(density.shape[0], view.right // 10 + 1), min(density.shape[1], view.bottom // 10 + 1)
+    if col0 >= col1 or row0 >= row1:
+        return
+    scale_max = max(8, density.max())
+    density = density[col0:col1, row0:row1]
+    if not density.any():
+        return
+    level = np.minimum(density * (255 / scale_max), 255).astype(np.uint8)
+    colors = np.zeros(density.shape + (3,), dtype=np.uint8)
+    occupied = density > 0
+    colors[..., 0] = np.where(occupied, 255, 0)
+    colors[..., 1] = np.where(occupied, 255 - level, 0)
+    overlay = pygame.surfarray.make_surface(colors)
+    overlay.set_colorkey((0, 0, 0))
+    overlay.set_alpha(170)
+    overlay = pygame.transform.scale(overlay, (density.shape[0] * 10, density.shape[1] * 10))
+    screen.blit(overlay, world_to_screen(col0 * 10, row0 * 10))
 
 def handle_button(id, objects):
     global current_building_menu
     if id.startswith("building_"):
         if id.startswith("building_layout_"):
             for building in objects[0][0]:
-                if building.button.id == id:
+                if id == f"building_layout_{building.name}":
                     subject = building
                     break
-            for i in objects[3][0]["buildings"]["layout_menus"]:
+            layout_menus = objects[3][0]["buildings"]["layout_menus"]
+            menu = None
+            for i in layout_menus:
                 if i.block_id == f"layout_menu_{subject.name}":
                     menu = i
                     break
+            if menu is None:
+                menu = create_layout_menu(subject)
+                layout_menus.append(menu)
             if current_building_menu and current_building_menu.block_id == f"layout_menu_{subject.name}":
                 current_building_menu = None  # Close menu
             else:
@@ -1109,6 +2594,8 @@ def screen_to_world(screen_x, screen_y):
 pygame.font.init()
 
 # Font cache to avoid creating fonts every frame
+_world_layer = WorldLayer()
+_text_cache = TextCache()
 _font_cache = {}
 
 def get_font(size, name=None, bold=False, italic=False):
@@ -1120,36 +2607,23 @@ def get_font(size, name=None, bold=False, italic=False):
         else:
             _font_cache[cache_key] = pygame.font.Font(None, size)
     return _font_cache[cache_key]
-        
-screen = pygame.display.set_mode((750, 750))
-pygame.display.set_caption("Campus")
-
-# Request window focus/activation
-pygame.event.set_grab(False)  # Ensure mouse isn't grabbed
-pygame.mouse.set_visible(True)  # Ensure mouse is visible
 
-# Pump events to process window activation
-for _ in range(10):
-    pygame.event.pump()
-    pygame.time.delay(10)
-
-clock = pygame.time.Clock()
-
-def initialize_game():
+def render_text(text, size, color, font_name=None, antialias=True):
+    """Rendered text from the shared LRU, rasterized only on a miss"""
+    return _text_cache.get(text, size, color, font_name, antialias)
+        
+def initialize_game(seed=None, cache=None, campus=None, interiors=None):
     global buildings, green_spaces, structures, heat_map, map_buttons, building_labels
-    # Place all structures
-    heat_map = gen_board((75, 75), 6)
-    buildings = place_buildings(heat_map)
-    green_spaces = place_green_spaces(heat_map, buildings)
-    structures = [buildings, green_spaces]
+    # Place all structures, unless a finished campus was handed in
+    if campus is None:
+        campus = load_or_generate_campus(seed, cache=cache, interiors=interiors)
+    print(f"Campus seed {campus.seed}")
+    heat_map = campus.heat_map
+    buildings = campus.buildings
+    green_spaces = campus.green_spaces
+    structures = campus.structures()
     building_labels = []
-
-
-    # Further information about buildings
-    connect_buildings(buildings)
-    assign_buildings(buildings)
-    make_building_corridors(buildings)
-    make_rooms(buildings)
+    _world_layer.invalidate()
 
     # Set up map
     map_buttons = create_building_buttons(buildings, 10)
@@ -1158,107 +2632,216 @@ def initialize_game():
     absolute_objects = create_absolute_blocks(buildings)
 
     return structures, map_buttons, building_labels, absolute_objects
-objects = initialize_game()
-running = True
-structures = objects[0]
-map_buttons = objects[1]
-building_labels = objects[2]
-absolute_objects = objects[3]
-floor = 0
-mode = "normal"
-current_building_menu = None
-
-while running:
-    # prepare frame
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Campus generator and viewer")
+    parser.add_argument("--headless", action="store_true", help="generate campuses without opening a window")
+    parser.add_argument("--count", type=int, default=100, help="number of campuses to generate in headless mode")
+    parser.add_argument("--seed", type=int, default=None, help="campus seed (first seed in headless mode)")
+    parser.add_argument("--grid", type=int, nargs=2, default=(75, 75), metavar=("COLS", "ROWS"), help="grid size in tiles")
+    parser.add_argument("--buildings", type=int, default=20, help="number of buildings to attempt to place")
+    parser.add_argument("--zones", type=int, default=5, help="number of horizontal placement zones")
+    parser.add_argument("--zone-tiles", type=int, default=300, help="building tiles that fill a zone")
+    parser.add_argument("--zone-buildings", type=int, default=4, help="buildings that fill a zone")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for headless generation")
+    parser.add_argument("--no-cache", action="store_true", help="always regenerate the campus at startup")
+    parser.add_argument("--cache-size", type=float, default=64, help="layout cache limit in MB")
+    parser.add_argument("--cache-stats", action="store_true", help="print layout cache hits and misses")
+    parser.add_argument("--interior-cache", type=int, default=256, help="building floors kept generated at once in the viewer")
+    parser.add_argument("--bench-memory", type=int, metavar="BUILDINGS", help="measure object memory for this many buildings and exit")
+    parser.add_argument("--bench-routes", type=int, metavar="QUERIES", help="time route queries on a generated campus and exit")
+    parser.add_argument("--bench-students", type=int, metavar="STUDENTS", help="time the student simulation and exit")
+    parser.add_argument("--students", type=int, default=0, help="simulate this many students in the viewer with a density overlay")
+    parser.add_argument("--check-interiors", type=int, metavar="SEEDS", help="check lazy interiors against eager generation for this many seeds and exit")
+    parser.add_argument("--bench-timetable", action="store_true", help="time the timetable solver on growing campuses and exit")
+    parser.add_argument("--export", metavar="PATH", help="in headless mode, stream campuses to a JSONL file (.gz to compress)")
+    parser.add_argument("--save", metavar="PATH", help="write the campus to a snapshot file")
+    parser.add_argument("--load", metavar="PATH", help="open a campus from a snapshot file instead of generating one")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.bench_memory:
+        memory_benchmark(args.bench_memory)
+        sys.exit(0)
+    if args.bench_routes:
+        route_benchmark(args.bench_routes, args.seed or 0)
+        sys.exit(0)
+    if args.bench_students:
+        student_benchmark(args.bench_students, seed=args.seed or 0)
+        sys.exit(0)
+    if args.bench_timetable:
+        timetable_benchmark(seed=args.seed or 0)
+        sys.exit(0)
+    if args.check_interiors:
+        sys.exit(1 if check_lazy_interiors(args.check_interiors, args.seed or 0) else 0)
+    if args.headless and args.export:
+        seeds = range(args.seed or 0, (args.seed or 0) + args.count)
+        exported = export_campuses(args.export, seeds, tuple(args.grid), args.buildings, args.zones, args.zone_tiles, args.zone_buildings, args.workers)
+        print(f"Exported {exported} campuses to {args.export}")
+        sys.exit(0)
+    if args.headless:
+        run_batch(args.count, args.seed or 0, tuple(args.grid), args.buildings, args.zones, args.zone_tiles, args.zone_buildings, args.workers)
+        sys.exit(0)
+
+    screen = pygame.display.set_mode((750, 750))
+    pygame.display.set_caption("Campus")
+
+    # Request window focus/activation
+    pygame.event.set_grab(False)  # Ensure mouse isn't grabbed
+    pygame.mouse.set_visible(True)  # Ensure mouse is visible
+
+    # Pump events to process window activation
+    for _ in range(10):
+        pygame.event.pump()
+        pygame.time.delay(10)
+
+    clock = pygame.time.Clock()
+
+    layout_cache = None if args.no_cache else LayoutCache(max_bytes=int(args.cache_size * 1024 * 1024), verbose=args.cache_stats)
+    interiors = InteriorCache(args.interior_cache)
+    campus = None
+    if args.load:
+        campus = CampusSnapshot.load(args.load).to_campus(interiors)
+    elif args.save:
+        campus = load_or_generate_campus(args.seed, cache=layout_cache, interiors=interiors)
+    if args.save:
+        CampusSnapshot.save(campus, args.save)
+    objects = initialize_game(args.seed, layout_cache, campus, interiors)
+    students = None
+    if args.students:
+        students = StudentSimulation(NavigationGraph(buildings), args.students, args.seed or 0, as_heat_map(heat_map).shape)
+    running = True
+    structures = objects[0]
+    map_buttons = objects[1]
+    building_labels = objects[2]
+    absolute_objects = objects[3]
+    floor = 0
+    mode = "normal"
+    current_building_menu = None
+    scheduler = RenderScheduler()
+
+    while running:
+        # prepare frame
+        open_menu = current_building_menu
+        view_state = (floor, mode)
+        # A held pan key sends a single KEYDOWN, so keep the loop running until it is released
+        keys = pygame.key.get_pressed()
+        panning = keys[pygame.K_w] or keys[pygame.K_a] or keys[pygame.K_s] or keys[pygame.K_d]
     
-    for event in pygame.event.get():
-        # quit
-        if event.type == pygame.QUIT:
-            running = False
-        if event.type == pygame.KEYDOWN and mode == "interior":
-            if event.key == pygame.K_UP:
-                floor += 1
-                if floor >= 3:
-                    floor = 3
-            if event.key == pygame.K_DOWN:
-                floor -= 1
-                if floor < 0:
-                    floor = 0
-        # if event.type == pygame.KEYDOWN:
-        #     if event.key == pygame.K_SPACE:
-        #         structures, map_buttons, building_labels = initialize_game()
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_i:
-                if mode == "normal":
-                    floor = 0
-                    mode = "interior"
-                elif mode == "interior":
-                    mode = "normal"
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            mouse_pos = pygame.mouse.get_pos()
-            for button in map_buttons:
-                if button.visible and button.check_click(mouse_pos):
-                    button.held = True
-        # check click
-        if event.type == pygame.MOUSEBUTTONUP:
-            mouse_pos = pygame.mouse.get_pos()
+        for event in scheduler.events(students is not None or panning):
+            # quit
+            if event.type == pygame.QUIT:
+                running = False
+            # the window was uncovered or restored, its contents may be gone
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame.WINDOWSIZECHANGED):
+                scheduler.mark_all()
+            if event.type == pygame.KEYDOWN and mode == "interior":
+                if event.key == pygame.K_UP:
+                    floor += 1
+                    if floor >= 3:
+                        floor = 3
+                if event.key == pygame.K_DOWN:
+                    floor -= 1
+                    if floor < 0:
+                        floor = 0
+            # if event.type == pygame.KEYDOWN:
+            #     if event.key == pygame.K_SPACE:
+            #         structures, map_buttons, building_labels = initialize_game()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_i:
+                    if mode == "normal":
+                        floor = 0
+                        mode = "interior"
+                    elif mode == "interior":
+                        mode = "normal"
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                mouse_pos = pygame.mouse.get_pos()
+                for button in map_buttons:
+                    if button.visible and button.check_click(mouse_pos):
+                        button.held = True
+            # check click
+            if event.type == pygame.MOUSEBUTTONUP:
+                mouse_pos = pygame.mouse.get_pos()
             
-            # Check menu first - close if clicked outside
-            if current_building_menu:
-                mx, my = mouse_pos
-                menu = current_building_menu
+                # Check menu first - close if clicked outside
+                if current_building_menu:
+                    mx, my = mouse_pos
+                    menu = current_building_menu
                 
-                # If clicked outside menu, close it
-                if not (menu.location[0] <= mx <= menu.location[0] + menu.dimensions[0] and
-                        menu.location[1] <= my <= menu.location[1] + menu.dimensions[1]):
-                    current_building_menu = None
-                else:
-                    continue
+                    # If clicked outside menu, close it
+                    if not (menu.location[0] <= mx <= menu.location[0] + menu.dimensions[0] and
+                            menu.location[1] <= my <= menu.location[1] + menu.dimensions[1]):
+                        current_building_menu = None
+                    else:
+                        continue
             
-            # Then handle button clicks
-            for button in map_buttons:
-                if button.held:
-                    button.held = False
-                    if button.visible and button.check_click(mouse_pos):
-                        handle_button(button.id, objects)
+                # Then handle button clicks
+                for button in map_buttons:
+                    if button.held:
+                        button.held = False
+                        if button.visible and button.check_click(mouse_pos):
+                            handle_button(button.id, objects)
                     
+        if (floor, mode) != view_state:
+            scheduler.mark_all()
+        if current_building_menu is not open_menu:
+            # Opening draws the new menu, closing uncovers the board under the old one
+            for menu in (open_menu, current_building_menu):
+                if menu is not None:
+                    scheduler.mark(menu.screen_rect())
     
-    # Camera controls (smooth movement)
-    keys = pygame.key.get_pressed()
-    camera_speed = 5
-    if keys[pygame.K_w]: camera_offset[1] -= camera_speed  # Pan up
-    if keys[pygame.K_s]: camera_offset[1] += camera_speed  # Pan down
-    if keys[pygame.K_a]: camera_offset[0] -= camera_speed  # Pan left
-    if keys[pygame.K_d]: camera_offset[0] += camera_speed  # Pan right
+        # Camera controls (smooth movement)
+        panned_from = camera_offset[:]
+        keys = pygame.key.get_pressed()
+        camera_speed = 5
+        if keys[pygame.K_w]: camera_offset[1] -= camera_speed  # Pan up
+        if keys[pygame.K_s]: camera_offset[1] += camera_speed  # Pan down
+        if keys[pygame.K_a]: camera_offset[0] -= camera_speed  # Pan left
+        if keys[pygame.K_d]: camera_offset[0] += camera_speed  # Pan right
     
-    # Clamp camera to keep map visible
-    screen_width = screen.get_width()
-    screen_height = screen.get_height()
-    map_size_grid = 75  # Map is 75x75 grid
-    map_size_world = map_size_grid * 10 * zoom_level  # World pixels at current zoom
+        # Clamp camera to keep map visible
+        screen_width = screen.get_width()
+        screen_height = screen.get_height()
+        map_size_grid = 75  # Map is 75x75 grid
+        map_size_world = map_size_grid * 10 * zoom_level  # World pixels at current zoom
     
-    # Allow panning with margin
-    margin_x = screen_width * 0.25
-    margin_y = screen_height * 0.25
+        # Allow panning with margin (whole pixels, so the cached world chunks stay pixel-aligned)
+        margin_x = screen_width // 4
+        margin_y = screen_height // 4
     
-    # Clamp camera offset
-    # Min: don't pan too far left/up (map right/bottom edge stays on screen)
-    # Max: don't pan too far right/down (map left/top edge stays on screen)
-    camera_offset[0] = max(-margin_x, min(camera_offset[0], map_size_world - screen_width + margin_x))
-    camera_offset[1] = max(-margin_y, min(camera_offset[1], map_size_world - screen_height + margin_y))
+        # Clamp camera offset
+        # Min: don't pan too far left/up (map right/bottom edge stays on screen)
+        # Max: don't pan too far right/down (map left/top edge stays on screen)
+        camera_offset[0] = max(-margin_x, min(camera_offset[0], map_size_world - screen_width + margin_x))
+        camera_offset[1] = max(-margin_y, min(camera_offset[1], map_size_world - screen_height + margin_y))
+        if camera_offset != panned_from:
+            scheduler.mark_all()
     
-    mouse_pos = pygame.mouse.get_pos()
-    mouse_pressed = pygame.mouse.get_pressed()[0]  # Left button
-
-    for button in map_buttons:
-        is_hovering = button.check_click(mouse_pos)
-        is_held = is_hovering and mouse_pressed
-        if button.visible:
-            button.color = button.pressed_color if is_held else button.normal_color
-    draw_board(screen, structures, floor, mode) 
-    if current_building_menu:
-        current_building_menu.render(screen)
-    pygame.display.flip()
-    clock.tick(60)  
-
-pygame.quit()  
+        mouse_pos = pygame.mouse.get_pos()
+        mouse_pressed = pygame.mouse.get_pressed()[0]  # Left button
+
+        for button in buttons_in_view(structures, screen):
+            is_hovering = button.check_click(mouse_pos)
+            is_held = is_hovering and mouse_pressed
+            if button.visible:
+                color = button.pressed_color if is_held else button.normal_color
+                if color != button.color:
+                    button.color = color
+                    scheduler.mark(button.screen_rect())
+        density = None
+        if students is not None:
+            students.step()
+            density = students.density(floor if mode == "interior" else None)
+            scheduler.mark_all()  # The density overlay moves every tick
+        if scheduler.begin(screen):
+            draw_board(screen, structures, floor, mode, density)
+            if current_building_menu:
+                current_building_menu.render(screen)
+            scheduler.present(screen)
+        clock.tick(60)  
+
+    if args.cache_stats:
+        print(f"Frames: {scheduler.frames} presented, {scheduler.idle_waits} idle waits")
+        print(f"Text cache: {_text_cache.hits} hits, {_text_cache.misses} misses, {len(_text_cache.surfaces)} surfaces ({_text_cache.bytes / 1024:.0f} KB)")
+    pygame.quit()  